@@ -1,4 +1,5 @@
 import os
+import click
 from flask import Flask, jsonify
 from flask_restful import Api
 
@@ -9,6 +10,7 @@ from blacklist import BLACKLIST
 from dotenv import load_dotenv
 from flask_uploads import configure_uploads, patch_request_class
 from flask_migrate import Migrate
+from werkzeug.middleware.proxy_fix import ProxyFix
 
 from ma import ma
 from db import db
@@ -32,6 +34,7 @@ from resources.user import (
     UserRegister,
     UserLogin,
     User,
+    UserList,
     TokenRefresh,
     UserLogout,
     # UserConfirm,
@@ -40,12 +43,31 @@ from resources.user import (
 from resources.item import Item, ItemList
 from resources.store import Store, StoreList
 from resources.confirmation import Confirmation, ConfirmationByUser
-from resources.image import ImageUpload, Image, AvatarUpload, Avatar
+from resources.image import ImageUpload, Image, ImageDerivative, AvatarUpload, Avatar
 from resources.github_login import GithubLogin, GithubAuthorize
 from resources.order import Order
+from models.order import OrderModel
+from models.idempotency import IdempotentResponseModel
+from models.confirmation import ConfirmationModel
+from resources.cache import FinderCacheStats
+from resources.payments import PaymentClientStats
+from resources.revenue import RevenueByDay, RevenueByItem
+from resources.fake_mailgun import FakeMailgunMessages
+from resources.mailgun import MailgunStats
 
 # IMAGE_SET will be needed to configure uploads
 from libs.image_helper import IMAGE_SET
+from libs.cache import configure_finder_cache
+from libs.payments import configure_payment_client
+from libs.charge_queue import ChargeWorkerPool, start_charge_workers
+from libs.token_cache import configure_token_cache
+from libs.passwords import configure_password_hasher
+from libs.rate_limit import configure_rate_limiter
+from libs.mail_outbox import create_mail_dispatcher, start_mail_dispatcher
+from libs.mailgun import Mailgun
+from libs.periodic import PeriodicJob
+from libs.avatar_manifest import avatar_manifest
+from libs.image_derivatives import derivative_store
 
 app = Flask(__name__)
 # this looks for object first inside the python file, if none, it then loads the constants inside the python file
@@ -57,6 +79,22 @@ override with default_config.py if APPLICATION_SETTINGS points to config.py with
 it doesn't change the variables not set in config.py that are in default_config.py
 """
 app.config.from_envvar("APPLICATION_SETTINGS")
+configure_finder_cache(app.config)
+configure_payment_client(app.config)
+BLACKLIST.configure(app.config)
+configure_token_cache(app.config)
+configure_password_hasher(app.config)
+configure_rate_limiter(app.config)
+Mailgun.configure(app.config)
+avatar_manifest.configure(app.config)
+derivative_store.configure(app.config)
+if app.config["TRUSTED_PROXY_COUNT"]:
+    # request.remote_addr becomes the client's address from X-Forwarded-For instead of the proxy's
+    app.wsgi_app = ProxyFix(
+        app.wsgi_app,
+        x_for=app.config["TRUSTED_PROXY_COUNT"],
+        x_proto=app.config["TRUSTED_PROXY_COUNT"],
+    )
 patch_request_class(
     app, 10 * 1024 * 1024
 )  # restrict max upload image size to 10MB(10 bytes * kilo *mega)
@@ -76,11 +114,77 @@ jwt = JWTManager(app)
 
 # This works together with SQLAlchemy very well
 migrate = Migrate(app, db)
+# here and not only under __main__ below, the `flask` commands(db upgrade, recover-orders...) import this module too
+db.init_app(app)
 
 
 @app.before_first_request
 def create_tables():
     db.create_all()
+    IdempotentResponseModel.purge_expired()
+    if app.config["ORDER_ASYNC_CHECKOUT"] and app.config["CHARGE_WORKERS"]:
+        start_charge_workers(app)
+    if app.config["MAIL_DISPATCHER"]:
+        start_mail_dispatcher(app)
+    if app.config["REVOCATION_PURGE_INTERVAL"]:
+        PeriodicJob(
+            app, BLACKLIST.prune, app.config["REVOCATION_PURGE_INTERVAL"], "purge_revoked_tokens"
+        ).start()
+    if app.config["CONFIRMATION_PURGE_INTERVAL"]:
+        PeriodicJob(
+            app, purge_expired_confirmations, app.config["CONFIRMATION_PURGE_INTERVAL"]
+        ).start()
+    if app.config["ORDER_RECOVERY_INTERVAL"]:
+        # orders left pending by a worker that crashed while charging them, in the background since every stale
+        # order costs a call to Stripe
+        PeriodicJob(
+            app, OrderModel.fail_stale_pending, app.config["ORDER_RECOVERY_INTERVAL"], "recover_orders"
+        ).start()
+
+
+def purge_expired_confirmations() -> int:
+    return ConfirmationModel.purge_expired(
+        batch_size=app.config["CONFIRMATION_PURGE_BATCH_SIZE"]
+    )
+
+
+@app.cli.command("recover-orders")
+def recover_orders():
+    print(f"{OrderModel.fail_stale_pending()} stale pending order(s) settled.")
+
+
+@app.cli.command("purge-confirmations")
+@click.option(
+    "--batch-size",
+    type=int,
+    help="Rows deleted per transaction, CONFIRMATION_PURGE_BATCH_SIZE by default.",
+)
+def purge_confirmations(batch_size):
+    deleted = ConfirmationModel.purge_expired(
+        batch_size=batch_size or app.config["CONFIRMATION_PURGE_BATCH_SIZE"]
+    )
+    print(f"{deleted} expired confirmation(s) deleted.")
+
+
+# after avatars were added or removed by hand, see libs/avatar_manifest.py
+@app.cli.command("rebuild-avatar-manifest")
+def rebuild_avatar_manifest():
+    print(f"{avatar_manifest.rebuild()} avatar(s) found.")
+
+
+# runs the charge workers in their own process, set CHARGE_WORKERS=0 to keep them out of the web workers
+@app.cli.command("charge-worker")
+@click.option("--workers", default=4, help="Number of charge worker threads.")
+def charge_worker(workers):
+    ChargeWorkerPool(
+        app, workers=workers, poll_interval=app.config["CHARGE_POLL_INTERVAL"]
+    ).run()
+
+
+# sends the queued emails from its own process, set MAIL_DISPATCHER=False to keep it out of the web workers
+@app.cli.command("mail-dispatcher")
+def mail_dispatcher():
+    create_mail_dispatcher(app).run()
 
 
 # setting app level error handlers
@@ -180,6 +284,7 @@ api.add_resource(ItemList, "/items")
 api.add_resource(UserRegister, "/register")
 api.add_resource(UserLogin, "/login")
 api.add_resource(User, "/user/<int:user_id>")
+api.add_resource(UserList, "/users")
 api.add_resource(TokenRefresh, "/refresh")
 api.add_resource(UserLogout, "/logout")
 # api.add_resource(UserConfirm, "/user_confirm/<int:user_id>")
@@ -187,6 +292,7 @@ api.add_resource(Confirmation, "/user_confirm/<string:confirmation_id>")
 api.add_resource(ConfirmationByUser, "/confirmation/user/<int:user_id>")
 api.add_resource(ImageUpload, "/upload/image")
 api.add_resource(Image, "/image/<string:filename>")
+api.add_resource(ImageDerivative, "/image/<string:filename>/derivative")
 api.add_resource(AvatarUpload, "/upload/avatar")
 api.add_resource(Avatar, "/avatar/<int:user_id>")
 api.add_resource(GithubLogin, "/login/github")
@@ -196,9 +302,16 @@ api.add_resource(
 )
 api.add_resource(SetPassword, "/user/password")
 api.add_resource(Order, "/order")
+api.add_resource(FinderCacheStats, "/cache/stats")
+api.add_resource(PaymentClientStats, "/payments/stats")
+api.add_resource(MailgunStats, "/mailgun/stats")
+api.add_resource(RevenueByDay, "/revenue/daily")
+api.add_resource(RevenueByItem, "/revenue/item/<int:item_id>")
+if app.config["MAILGUN_FAKE"]:
+    api.add_resource(FakeMailgunMessages, "/fake-mailgun/v3/<string:domain>/messages")
 
 if __name__ == "__main__":
-    db.init_app(app)
+    # db.init_app(app)
     # this tells the ma(Marshmallow object) what flask app it should be talking to
     ma.init_app(app)
     oauth.init_app(app)
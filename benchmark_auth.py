@@ -0,0 +1,68 @@
+import os
+import shutil
+from timeit import timeit
+
+from flask_jwt_extended import create_access_token
+from flask_jwt_extended.view_decorators import verify_jwt_in_request
+
+from app import app
+from db import db
+from ma import ma
+from libs.token_cache import token_cache
+from models.store import StoreModel
+from models.item import ItemModel
+
+"""
+Per-request cost of authenticating a JWT with and without the decode cache from libs/token_cache.py, measured on
+GET /items and GET /image/<filename> and on the auth step alone.
+Runs against an in-memory sqlite database and writes one image under static/images/user_1 that is removed afterwards.
+run with: python benchmark_auth.py
+"""
+
+REQUESTS = 2_000
+
+app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+db.init_app(app)
+ma.init_app(app)
+
+with app.app_context():
+    db.create_all()
+    store = StoreModel(name="benchmark")
+    db.session.add(store)
+    db.session.flush()
+    for n in range(20):
+        db.session.add(ItemModel(name=f"item_{n}", price=n, store_id=store.id))
+    db.session.commit()
+    token = create_access_token(identity=1, fresh=True)
+
+folder = os.path.join(app.config["UPLOADED_IMAGES_DEST"], "user_1")
+created_folder = not os.path.isdir(folder)
+os.makedirs(folder, exist_ok=True)
+image = os.path.join(folder, "benchmark.png")
+with open(image, "wb") as f:
+    f.write(b"\x89PNG\r\n\x1a\n" + bytes(1024))
+
+headers = {"Authorization": f"Bearer {token}"}
+client = app.test_client()
+client.get("/items", headers=headers)  # runs before_first_request
+
+try:
+    for label, run in (
+        ("auth only", lambda: verify_jwt_in_request()),
+        ("GET /items", lambda: client.get("/items", headers=headers)),
+        ("GET /image/benchmark.png", lambda: client.get("/image/benchmark.png", headers=headers)),
+    ):
+        timings = {}
+        for size in (0, 1024):
+            token_cache.max_size = size
+            token_cache.clear()
+            with app.test_request_context(headers=headers):
+                timings[size] = timeit(run, number=REQUESTS) / REQUESTS * 1_000_000
+        print(
+            f"{label}: uncached {timings[0]:.0f}us, cached {timings[1024]:.0f}us "
+            f"(saves {timings[0] - timings[1024]:.0f}us per request)"
+        )
+finally:
+    os.remove(image)
+    if created_folder:
+        shutil.rmtree(folder)
@@ -0,0 +1,53 @@
+from timeit import timeit
+
+from models.item import ItemModel
+from models.store import StoreModel
+from models.order import OrderModel, ItemsInOrder
+from schemas.item import ItemSchema
+from schemas.store import StoreSchema
+from schemas.order import OrderSchema
+from libs.schema_compiler import compile_schema
+
+"""
+Compares marshmallow's Schema.dump with the compiled dump functions from libs/schema_compiler.py
+No database is needed, the models are built in memory
+run with: python benchmark_serializing.py
+"""
+
+ROWS = 100_000
+ROUNDS = 3
+
+items = [
+    ItemModel(id=_id, name=f"item_{_id}", price=_id / 100, store_id=_id % 50)
+    for _id in range(ROWS)
+]
+
+stores = []
+for _id in range(ROWS // 100):
+    store = StoreModel(id=_id, name=f"store_{_id}")
+    store._catalog_items = items[_id * 100 : (_id + 1) * 100]
+    stores.append(store)
+
+orders = [
+    OrderModel(
+        id=_id,
+        status="complete",
+        items=[ItemsInOrder(id=_id * 2 + n, quantity=n + 1) for n in range(2)],
+    )
+    for _id in range(ROWS // 10)
+]
+
+for schema, rows in (
+    (ItemSchema(many=True), items),
+    (StoreSchema(many=True), stores),
+    (OrderSchema(many=True), orders),
+):
+    compiled = compile_schema(schema)
+    assert compiled.dump(rows) == schema.dump(rows)
+
+    marshmallow_time = timeit(lambda: schema.dump(rows), number=ROUNDS) / ROUNDS
+    compiled_time = timeit(lambda: compiled.dump(rows), number=ROUNDS) / ROUNDS
+    print(
+        f"{type(schema).__name__} x {len(rows)}: marshmallow {marshmallow_time:.3f}s, "
+        f"compiled {compiled_time:.3f}s ({marshmallow_time / compiled_time:.1f}x)"
+    )
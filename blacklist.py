@@ -1,11 +1,19 @@
+from libs.revocation import RevocationStore
+
 """
 blacklist.py
 This allows us to have a list of things that we don't want give access to like users id, tokens e.t.c
 
-This file just contains the list of JWT tokens that have been revoked through logging out 
+This file contains the store of JWT tokens that have been revoked through logging out
 it will be imported by app and used by logout resource so that tokens unique id can be added to the blacklist 
 when the user logs out.
+
+It used to be a set() in memory, which every gunicorn worker had its own copy of and which grew forever, the revoked
+tokens now live in the database until they expire(see libs/revocation.py)
+    BLACKLIST.add(jti, expires_at)
+    jti in BLACKLIST
 """
 
 # BLACKLIST = {2, 3}
-BLACKLIST = set()
+# BLACKLIST = set()
+BLACKLIST = RevocationStore()
@@ -32,3 +32,83 @@ JWT_BLACKLIST_TOKEN_CHECKS = [
     "access",
     "refresh",
 ]  # allow blacklisting for access and refresh tokens
+# read-through cache of the models' find_by_* lookups(see libs/cache.py)
+# FINDER_CACHE_SIZE=0 disables it, FINDER_CACHE_REDIS_URL shares it between workers(requires the redis package)
+FINDER_CACHE_SIZE = 1024
+FINDER_CACHE_TTL = 60  # seconds
+FINDER_CACHE_REDIS_URL = os.environ.get("FINDER_CACHE_REDIS_URL")
+# when True, POST /order answers 202 right away and the charge is made by background workers(see libs/charge_queue.py)
+ORDER_ASYNC_CHECKOUT = False
+CHARGE_WORKERS = 4
+CHARGE_POLL_INTERVAL = 0.5  # seconds
+# settles the orders left pending by a crashed worker every ORDER_RECOVERY_INTERVAL seconds(0 disables it),
+# `flask recover-orders` does the same on demand
+ORDER_RECOVERY_INTERVAL = 300
+# use libs.payments.FakeStripeClient instead of Stripe, for load testing offline
+STRIPE_FAKE = False
+STRIPE_FAKE_LATENCY = 0.0  # seconds
+# Stripe client(see libs/payments.py), STRIPE_API_BASE can point it at a local stub server
+STRIPE_API_BASE = os.environ.get("STRIPE_API_BASE")
+STRIPE_CONNECT_TIMEOUT = 5  # seconds
+STRIPE_READ_TIMEOUT = 30  # seconds
+STRIPE_POOL_SIZE = 10  # keep-alive connections
+STRIPE_MAX_NETWORK_RETRIES = 2  # for timeouts, connection errors and 5xx answers
+# fail fast for STRIPE_BREAKER_RESET seconds after STRIPE_BREAKER_FAILURES consecutive Stripe failures
+STRIPE_BREAKER_FAILURES = 5
+STRIPE_BREAKER_RESET = 30
+# how often(seconds) each worker picks up the tokens revoked by the other workers, and rebuilds its filter
+REVOCATION_SYNC_INTERVAL = 1
+REVOCATION_REBUILD_INTERVAL = 300
+# deletes the revocations of tokens that have expired anyway every REVOCATION_PURGE_INTERVAL seconds(0 disables it)
+REVOCATION_PURGE_INTERVAL = 3600
+# verified claims of the last JWT_DECODE_CACHE_SIZE tokens, repeat tokens skip the signature check(see libs/token_cache.py)
+JWT_DECODE_CACHE_SIZE = 1024
+# password hashing(see libs/passwords.py), raising the iterations upgrades existing hashes as their users log in
+PASSWORD_HASH_ALGORITHM = "sha256"
+PASSWORD_HASH_ITERATIONS = 150000
+PASSWORD_HASH_SALT_LENGTH = 16
+PASSWORD_HASH_WORKERS = 2  # processes per web worker, 0 hashes on the request thread
+# number of reverse proxies(e.g nginx) in front of the app, the client's address is read from the X-Forwarded-For they
+# set. Keep 0 when the app is reached directly, clients could forge the header otherwise
+TRUSTED_PROXY_COUNT = 0
+# sliding window limits(requests, seconds) per client ip and per username(see libs/rate_limit.py)
+# RATE_LIMIT_REDIS_URL shares the counters between workers(requires the redis package)
+RATE_LIMIT_ENABLED = True
+RATE_LIMIT_REDIS_URL = os.environ.get("RATE_LIMIT_REDIS_URL")
+RATE_LIMITS = {
+    "login": {"ip": (20, 60), "username": (5, 60)},
+    "register": {"ip": (5, 60)},
+    "refresh": {"ip": (30, 60)},
+}
+# emails are queued in the email_outbox table and sent in batches by the mail dispatcher(see libs/mail_outbox.py)
+MAIL_DISPATCHER = True
+MAIL_BATCH_SIZE = 100  # recipients per Mailgun request, at most 1000
+MAIL_POLL_INTERVAL = 1  # seconds
+MAIL_MAX_ATTEMPTS = 5
+MAIL_RETRY_BACKOFF = 30  # seconds before the first retry, doubled for every retry after it
+# serve a fake Mailgun at /fake-mailgun/v3/<domain>/messages(see resources/fake_mailgun.py), for tests only
+MAILGUN_FAKE = False
+# Mailgun client(see libs/mailgun.py), MAILGUN_API_BASE in .env can point it at a local stub server
+MAILGUN_CONNECT_TIMEOUT = 5  # seconds
+MAILGUN_READ_TIMEOUT = 30  # seconds
+MAILGUN_POOL_SIZE = 10  # keep-alive connections
+MAILGUN_MAX_RETRIES = 3  # for 429/5xx answers
+MAILGUN_RETRY_BACKOFF = 0.5  # seconds, doubled for every retry
+# deletes the expired, unconfirmed confirmations every CONFIRMATION_PURGE_INTERVAL seconds(0 disables it),
+# CONFIRMATION_PURGE_BATCH_SIZE rows per transaction, `flask purge-confirmations` does the same on demand
+CONFIRMATION_PURGE_INTERVAL = 3600
+CONFIRMATION_PURGE_BATCH_SIZE = 1000
+# where each user's avatar is(see libs/avatar_manifest.py), the workers pick up each other's uploads within
+# AVATAR_MANIFEST_RELOAD_INTERVAL seconds
+AVATAR_MANIFEST_PATH = "avatar_manifest.json"
+AVATAR_MANIFEST_RELOAD_INTERVAL = 5
+# Cache-Control max-age(seconds) of the images and avatars, clients revalidate with their ETag afterwards
+IMAGE_CACHE_MAX_AGE = 3600
+AVATAR_CACHE_MAX_AGE = 300
+# let the front proxy send the image files: None, "x-accel-redirect"(nginx) or "x-sendfile"(see libs/image_response.py)
+IMAGE_OFFLOAD = None
+IMAGE_OFFLOAD_PREFIX = "/protected-images"  # nginx `internal` location aliased to UPLOADED_IMAGES_DEST
+# resized/re-encoded images served by /image/<filename>/derivative(see libs/image_derivatives.py, requires Pillow)
+IMAGE_DERIVATIVE_CACHE_DIR = "image_derivatives"
+IMAGE_DERIVATIVE_CACHE_SIZE = 256 * 1024 * 1024  # bytes, the least recently served derivatives are deleted first
+IMAGE_DERIVATIVE_MAX_DIMENSION = 2048  # pixels
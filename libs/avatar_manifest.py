@@ -0,0 +1,153 @@
+import json
+import os
+from contextlib import contextmanager
+from hashlib import blake2b
+from threading import Lock
+from time import monotonic
+from typing import Dict, Union
+
+from flask_uploads import IMAGES
+
+from libs import image_helper
+
+try:
+    import fcntl  # POSIX only, without it the writers of several processes are not serialized
+except ImportError:
+    fcntl = None
+
+"""
+libs.avatar_manifest
+
+Where each user's avatar is, so Avatar.get does not have to probe the disk for user_{id}.{ext} with every allowed
+extension(up to one stat() per extension, and all of them for a user without an avatar).
+The manifest maps user_id -> {path, mtime, size, etag} and lists every avatar, so a user that is not in it is known to
+have no avatar, that is the negative cache and it costs nothing to look up.
+
+It is kept in memory and persisted as json(AVATAR_MANIFEST_PATH), AvatarUpload.put updates both. Each write reloads the
+file under an exclusive lock first, so the gunicorn workers do not overwrite each other's updates, and every worker
+picks up the others' writes within `reload_interval` seconds(one stat() of the manifest per interval, not per request).
+When the file does not exist yet it is built by scanning the avatars folder once, `flask rebuild-avatar-manifest`
+does the same after avatars were added or removed by hand.
+"""
+
+AVATAR_FOLDER = "avatars"
+
+
+class AvatarManifest:
+    def __init__(self, path: str = "avatar_manifest.json", reload_interval: float = 5):
+        self.path = path
+        self.reload_interval = reload_interval
+        self._entries: Dict[int, Dict] = {}
+        self._file_mtime = None
+        self._checked_at = None
+        self._lock = Lock()
+
+    def configure(self, config) -> None:
+        """
+        Called from app.py once the config has been loaded
+        """
+        self.path = config.get("AVATAR_MANIFEST_PATH", self.path)
+        self.reload_interval = config.get("AVATAR_MANIFEST_RELOAD_INTERVAL", self.reload_interval)
+        self._checked_at = None  # reloaded from the new path on the next lookup
+
+    def get(self, user_id: int) -> Union[Dict, None]:
+        """
+        :return: {path, mtime, size, etag} of the user's avatar, None if they have none
+        """
+        now = monotonic()
+        if self._checked_at is None or now - self._checked_at >= self.reload_interval:
+            self._reload_if_changed()
+            self._checked_at = now
+        return self._entries.get(user_id)
+
+    def set(self, user_id: int, path: str) -> Dict:
+        """
+        Records the avatar just saved at `path`
+        """
+        entry = self._entry(path)
+        with self._write() as entries:
+            entries[user_id] = entry
+        return entry
+
+    def remove(self, user_id: int, path: str = None) -> None:
+        """
+        :param path: only remove the entry if it still points to this file. Our copy of the manifest can be behind the
+            file, removing a stale avatar must not drop the one another worker has saved since
+        """
+        with self._write() as entries:
+            if path is None or entries.get(user_id, {}).get("path") == path:
+                entries.pop(user_id, None)
+
+    def rebuild(self) -> int:
+        """
+        Scans the avatars folder and replaces the manifest with what is found
+        :return: the number of avatars found
+        """
+        folder = os.path.join(image_helper.IMAGE_SET.config.destination, AVATAR_FOLDER)
+        found = {}
+        if os.path.isdir(folder):
+            for name in os.listdir(folder):
+                stem, ext = os.path.splitext(name)
+                if stem.startswith("user_") and stem[5:].isdigit() and ext[1:] in IMAGES:
+                    found[int(stem[5:])] = self._entry(os.path.join(folder, name))
+
+        with self._write() as entries:
+            entries.clear()
+            entries.update(found)
+        return len(found)
+
+    @staticmethod
+    def _entry(path: str) -> Dict:
+        # the etag is a hash of the content, it only changes when the avatar does
+        digest = blake2b(digest_size=16)
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(65536), b""):
+                digest.update(chunk)
+        stat = os.stat(path)
+        return {
+            "path": path,
+            "mtime": stat.st_mtime,
+            "size": stat.st_size,
+            "etag": digest.hexdigest(),
+        }
+
+    def _read(self) -> Dict[int, Dict]:
+        with open(self.path) as f:
+            return {int(user_id): entry for user_id, entry in json.load(f).items()}
+
+    def _reload_if_changed(self) -> None:
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            self.rebuild()  # first run, or the manifest was deleted
+            return
+        if mtime != self._file_mtime:
+            with self._lock:
+                self._entries = self._read()
+                self._file_mtime = mtime
+
+    @contextmanager
+    def _write(self):
+        """
+        Yields the current entries to be changed, then persists them. The file is re-read under an exclusive lock so
+        the updates made by other processes since our last reload are kept
+        """
+        with self._lock, open(self.path + ".lock", "w") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                entries = self._read()
+            except FileNotFoundError:
+                entries = dict(self._entries or {})
+            yield entries
+
+            temporary = f"{self.path}.{os.getpid()}.tmp"
+            with open(temporary, "w") as f:
+                json.dump(entries, f)
+            os.replace(temporary, self.path)  # atomic, readers see the old or the new manifest
+            self._entries = entries
+            self._file_mtime = os.stat(self.path).st_mtime
+            # the lock is released when lock_file is closed
+
+
+avatar_manifest = AvatarManifest()
@@ -0,0 +1,309 @@
+import json
+from collections import OrderedDict
+from datetime import date, datetime
+from functools import wraps
+from threading import Lock
+from time import time
+from typing import Callable, Dict, Iterable, List, Set, Tuple
+
+from sqlalchemy import inspect
+from sqlalchemy.orm import make_transient_to_detached
+
+from db import db
+
+"""
+libs.cache
+
+Read-through cache for the find_by_* classmethods of our models.
+What we cache is a snapshot of the row's column values(or None when nothing was found) and not the model object
+itself, model objects belong to the session of the request that loaded them. On a hit the snapshot is turned back into
+a model and merged into the current session with load=False, which does not query the database.
+Snapshots only hold JSON types, and leave out the columns declared with info={"cache": False}(e.g password hashes),
+those are loaded from the database if they are used.
+
+Entries are invalidated by the models' save_to_db()/delete_from_db(), both the current and the previous value of each
+cached column are dropped so renaming something can not leave a stale entry behind.
+Every key has a version that invalidating it bumps, a lookup that missed only stores the row it read if the version is
+still the one it saw before reading. Otherwise a lookup that read the row just before a commit could store its stale
+copy after the commit's invalidation, for the whole TTL.
+
+The in-process LRU backend is per worker, set FINDER_CACHE_REDIS_URL to share the cache(and its invalidations) between
+gunicorn workers, otherwise other workers may serve a stale row for up to FINDER_CACHE_TTL seconds.
+"""
+
+MISSING = object()
+
+
+class LRUCacheBackend:
+    # versions live in a fixed number of slots shared by the keys that hash to them, bumping one slot for a key only
+    # costs its neighbours one store
+    VERSION_SLOTS = 4096
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._versions = [0] * self.VERSION_SLOTS
+        self._lock = Lock()
+
+    def get(self, key: Tuple):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return MISSING
+            expire_at, value = entry
+            if expire_at < time():
+                del self._entries[key]
+                return MISSING
+            self._entries.move_to_end(key)
+            return value
+
+    def version(self, key: Tuple) -> int:
+        return self._versions[hash(key) % self.VERSION_SLOTS]
+
+    def set(self, key: Tuple, value, version: int) -> None:
+        """
+        Stores the value unless the key was invalidated since `version` was read
+        """
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            if self.version(key) != version:
+                return
+            self._entries[key] = (time() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete_many(self, keys: Iterable[Tuple]) -> None:
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+                self._versions[hash(key) % self.VERSION_SLOTS] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class RedisCacheBackend:
+    """
+    Shared backend, redis is an optional dependency so it is only imported when this backend is configured.
+    Values are stored as JSON, the shared store is never trusted with pickles.
+    """
+
+    PREFIX = "finder:"
+    VERSION_PREFIX = "finder-version:"
+    # stores the value only if the key's version is still the one read before the lookup, atomically
+    SET_IF_VERSION = """
+        if (redis.call("GET", KEYS[2]) or "0") == ARGV[2] then
+            redis.call("SET", KEYS[1], ARGV[1], "EX", ARGV[3])
+        end
+    """
+
+    def __init__(self, url: str, ttl: float = 60):
+        import redis
+
+        self.ttl = ttl
+        self._client = redis.Redis.from_url(url)
+        self._set_if_version = self._client.register_script(self.SET_IF_VERSION)
+
+    def _key(self, key: Tuple) -> str:
+        return self.PREFIX + repr(key)
+
+    def _version_key(self, key: Tuple) -> str:
+        return self.VERSION_PREFIX + repr(key)
+
+    def get(self, key: Tuple):
+        value = self._client.get(self._key(key))
+        if value is None:
+            return MISSING
+        return json.loads(value)
+
+    def version(self, key: Tuple) -> int:
+        return int(self._client.get(self._version_key(key)) or 0)
+
+    def set(self, key: Tuple, value, version: int) -> None:
+        self._set_if_version(
+            keys=[self._key(key), self._version_key(key)],
+            args=[json.dumps(value), str(version), max(1, int(self.ttl))],
+        )
+
+    def delete_many(self, keys: Iterable[Tuple]) -> None:
+        keys = list(keys)
+        if keys:
+            pipeline = self._client.pipeline()
+            pipeline.delete(*[self._key(key) for key in keys])
+            for key in keys:
+                # kept a little longer than the entries, a lookup that started before the bump has finished by then
+                pipeline.incr(self._version_key(key))
+                pipeline.expire(self._version_key(key), max(1, int(self.ttl)) * 2)
+            pipeline.execute()
+
+    def clear(self) -> None:
+        for key in self._client.scan_iter(self.PREFIX + "*"):
+            self._client.delete(key)
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self._client.scan_iter(self.PREFIX + "*"))
+
+
+class FinderCache:
+    def __init__(self, backend=None):
+        self.backend = backend or LRUCacheBackend()
+        self.hits = 0
+        self.misses = 0
+        self._counters_lock = Lock()
+        # model --> columns that have a cached finder, used to know what to invalidate
+        self._cached_columns: Dict[type, Set[str]] = {}
+
+    def finder(self, column: str) -> Callable:
+        """
+        Decorates a finder classmethod taking the value of `column` and returning the first matching row or None
+            @classmethod
+            @finder_cache.finder("name")
+            def find_by_name(cls, name: str) -> "ItemModel":
+        """
+
+        def decorator(func: Callable) -> Callable:
+            @wraps(func)
+            def wrapper(cls, value):
+                key = (cls.__tablename__, column, value)
+                snapshot = self.backend.get(key)
+                if snapshot is not MISSING:
+                    self._count(hit=True)
+                    return self._restore(cls, snapshot)
+
+                self._count(hit=False)
+                version = self.backend.version(key)  # before reading the row, see the module docstring
+                found = func(cls, value)
+                self.backend.set(key, self._snapshot(found), version)
+                return found
+
+            wrapper.cached_column = column
+            return wrapper
+
+        return decorator
+
+    def _columns_of(self, model: type) -> Set[str]:
+        columns = self._cached_columns.get(model)
+        if columns is None:
+            columns = {
+                attr.__func__.cached_column
+                for attr in vars(model).values()
+                if isinstance(attr, classmethod)
+                and hasattr(attr.__func__, "cached_column")
+            }
+            self._cached_columns[model] = columns
+        return columns
+
+    def _count(self, hit: bool) -> None:
+        with self._counters_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    @staticmethod
+    def _snapshot(instance) -> Dict:
+        if instance is None:
+            return None
+        snapshot = {}
+        for attr in inspect(instance).mapper.column_attrs:
+            if attr.columns[0].info.get("cache", True):
+                value = getattr(instance, attr.key)
+                snapshot[attr.key] = value.isoformat() if isinstance(value, date) else value
+        return snapshot
+
+    @staticmethod
+    def _restore(cls, snapshot: Dict):
+        if snapshot is None:
+            return None
+        mapper = inspect(cls)
+        identity = mapper.identity_key_from_primary_key(
+            [
+                snapshot[mapper.get_property_by_column(column).key]
+                for column in mapper.primary_key
+            ]
+        )
+        # the session may already hold this row, possibly with pending changes we must not overwrite
+        existing = db.session.identity_map.get(identity)
+        if existing is not None:
+            return existing
+
+        values = dict(snapshot)
+        for attr in mapper.column_attrs:
+            if values.get(attr.key) is not None and isinstance(attr.columns[0].type, db.DateTime):
+                values[attr.key] = datetime.fromisoformat(values[attr.key])
+            elif values.get(attr.key) is not None and isinstance(attr.columns[0].type, db.Date):
+                values[attr.key] = date.fromisoformat(values[attr.key])
+        # the columns left out of the snapshot are not loaded, they are queried if they are used
+        instance = cls(**values)
+        make_transient_to_detached(instance)
+        return db.session.merge(instance, load=False)
+
+    def keys_for(self, instance) -> List[Tuple]:
+        """
+        Cache keys an instance is stored under, including the previous values of its pending changes
+        """
+        columns = self._columns_of(type(instance))
+        state = inspect(instance)
+        keys = []
+        for column in columns:
+            if column not in state.dict:
+                getattr(instance, column)  # load an expired attribute so we know its value
+            for value in state.attrs[column].history.sum():  # unchanged + added + deleted(the previous value)
+                keys.append((instance.__tablename__, column, value))
+        return keys
+
+    def invalidate(self, keys: List[Tuple]) -> None:
+        self.backend.delete_many(keys)
+
+    def save(self, instance) -> None:
+        """
+        Commits the instance and drops every cache entry for both its old and new values
+        """
+        stale = self.keys_for(instance)
+        db.session.add(instance)
+        db.session.flush()  # a new row gets its id here, so a cached "not found" for that id is dropped too
+        stale += self.keys_for(instance)
+        db.session.commit()
+        self.invalidate(stale)
+
+    def delete(self, instance) -> None:
+        stale = self.keys_for(instance)
+        db.session.delete(instance)
+        db.session.commit()
+        self.invalidate(stale)
+
+    def clear(self) -> None:
+        self.backend.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__,
+            "size": len(self.backend),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+        }
+
+
+finder_cache = FinderCache()
+
+
+def configure_finder_cache(config) -> None:
+    """
+    Picks the backend from the app config, called from app.py once the config has been loaded
+    """
+    ttl = config.get("FINDER_CACHE_TTL", 60)
+    if config.get("FINDER_CACHE_REDIS_URL"):
+        finder_cache.backend = RedisCacheBackend(config["FINDER_CACHE_REDIS_URL"], ttl)
+    else:
+        finder_cache.backend = LRUCacheBackend(config.get("FINDER_CACHE_SIZE", 1024), ttl)
@@ -0,0 +1,104 @@
+import traceback
+from threading import Event, Thread
+from typing import List
+
+from stripe import error
+
+from db import db
+from models.charge_job import ChargeJobModel
+from models.order import OrderModel, PENDING
+
+"""
+libs.charge_queue
+
+Background workers for the asynchronous checkout(ORDER_ASYNC_CHECKOUT=True).
+Order.post only writes the order and a ChargeJobModel and answers 202, each worker thread then claims queued jobs,
+charges them through OrderModel.checkout() and deletes the job, the client polls the order to see the outcome.
+Because jobs are claimed with a conditional UPDATE, the workers of several processes can share the same queue table.
+"""
+
+
+class ChargeWorkerPool:
+    def __init__(self, app, workers: int = 4, poll_interval: float = 0.5):
+        self.app = app
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self._stop = Event()
+        self._threads: List[Thread] = []
+
+    def start(self) -> None:
+        for number in range(self.workers):
+            thread = Thread(target=self._run, name=f"charge-worker-{number}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def run(self) -> None:
+        """
+        Starts the workers and blocks until interrupted, used to run them in a dedicated process
+        """
+        self.start()
+        try:
+            while not self._stop.wait(1):
+                pass
+        except KeyboardInterrupt:
+            self.stop()
+
+    def stop(self, timeout: float = None) -> None:
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            with self.app.app_context():
+                try:
+                    processed = self.process_next()
+                except Exception:
+                    traceback.print_exc()
+                    processed = False
+                finally:
+                    db.session.remove()
+            if not processed:
+                self._stop.wait(self.poll_interval)
+
+    @staticmethod
+    def process_next() -> bool:
+        """
+        Claims and charges one job, must be called inside an app context
+        :return: False when the queue was empty
+        """
+        job = ChargeJobModel.claim_next()
+        if job is None:
+            return False
+
+        # the token is not in the row anymore, it is read before anything reloads the job
+        job_id, token = job.id, job.token
+        order = OrderModel.find_by_id(job.order_id)
+        # the order may have been failed by the crash recovery sweep in the meantime
+        if order is not None and order.status == PENDING:
+            try:
+                order.checkout(token)
+            except error.StripeError:
+                pass  # the order is already marked as failed by checkout(), the client sees it when polling
+            except Exception:
+                traceback.print_exc()
+        # by id, the job may have been dropped by the crash recovery sweep already
+        ChargeJobModel.query.filter_by(id=job_id).delete(synchronize_session=False)
+        db.session.commit()
+        return True
+
+
+charge_workers = None
+
+
+def start_charge_workers(app) -> ChargeWorkerPool:
+    global charge_workers
+    if charge_workers is None:
+        charge_workers = ChargeWorkerPool(
+            app,
+            workers=app.config.get("CHARGE_WORKERS", 4),
+            poll_interval=app.config.get("CHARGE_POLL_INTERVAL", 0.5),
+        )
+        charge_workers.start()
+    return charge_workers
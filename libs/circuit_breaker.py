@@ -0,0 +1,65 @@
+from threading import Lock
+from time import monotonic
+from typing import Dict
+
+"""
+libs.circuit_breaker
+
+When an external service degrades, every request that calls it waits for the full timeout before failing and ties up
+a worker the whole time. The breaker counts consecutive failures, once `failure_threshold` is reached it opens and
+callers fail fast without calling the service. After `reset_timeout` seconds it lets one trial call through
+(half-open), success closes the breaker again and failure opens it for another `reset_timeout`.
+"""
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._lock = Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == OPEN and monotonic() - self._opened_at >= self.reset_timeout:
+                return HALF_OPEN
+            return self._state
+
+    def allow(self) -> bool:
+        """
+        Whether a call may go through now, a caller that is allowed must report the outcome with
+        record_success()/record_failure() whatever happens(in a finally), the breaker stays open until the half-open
+        trial call is reported
+        """
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if monotonic() - self._opened_at < self.reset_timeout or self._trial_running:
+                return False
+            self._trial_running = True  # only one trial call while half-open
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._state = CLOSED
+            self._failures = 0
+            self._trial_running = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+            if self._state != CLOSED or self._failures >= self.failure_threshold:
+                self._state = OPEN
+                self._opened_at = monotonic()
+
+    def snapshot(self) -> Dict:
+        return {"state": self.state, "consecutive_failures": self._failures}
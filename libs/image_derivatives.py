@@ -0,0 +1,243 @@
+import io
+import os
+from threading import Event, Lock
+from typing import Callable, Dict, Tuple, Union
+from uuid import uuid4
+
+from flask import request
+
+from libs.strings import gettext
+
+"""
+libs.image_derivatives
+
+Resized/re-encoded versions of the uploaded images, so a client that only needs a thumbnail does not download the
+original. Rendering needs Pillow, it is only imported when a derivative is rendered so the rest of the app runs without it.
+
+A derivative is identified by the content hash of its source(see libs.image_response.content_etag) and the
+parameters, e.g 3f2a...-200x0-q85.webp, so a new upload under the same name never serves an old derivative and the
+stale ones just age out of the cache.
+Rendered derivatives are kept in a folder bounded to `max_bytes`, the least recently served files are deleted first.
+When several requests ask for the same missing derivative at once only the first one renders it, the others wait for
+its result(per process, two workers may still render the same derivative once each, the writes are atomic).
+"""
+
+FORMATS = {"jpeg": "jpg", "png": "png", "webp": "webp"}  # format -> file extension
+PILLOW_FORMATS = {"jpeg": "JPEG", "png": "PNG", "webp": "WEBP"}
+
+
+class DerivativeException(Exception):
+    def __init__(self, message: str):
+        super().__init__(message)
+
+
+class UnreadableImageException(Exception):
+    """
+    The source can not be rendered, as opposed to the OSErrors of our own disk(full, permissions) which are not caught
+    """
+
+
+def get_derivative_args(max_dimension: int) -> Dict:
+    """
+    Reads and validates ?width= ?height= ?format= ?quality= from the current request
+    :return: {"width", "height", "format", "quality"}, width/height of 0 follow the aspect ratio of the source
+    """
+    args = {}
+    for name, low, high, default in (
+        ("width", 1, max_dimension, 0),
+        ("height", 1, max_dimension, 0),
+        ("quality", 1, 95, 85),
+    ):
+        try:
+            args[name] = int(request.args.get(name, default))
+        except ValueError:
+            args[name] = -1
+        if args[name] != default and not low <= args[name] <= high:
+            raise DerivativeException(
+                gettext("image_derivative_invalid_argument").format(name, low, high)
+            )
+
+    args["format"] = request.args.get("format", "").lower() or None
+    if args["format"] == "jpg":
+        args["format"] = "jpeg"
+    if args["format"] is not None and args["format"] not in FORMATS:
+        raise DerivativeException(
+            gettext("image_derivative_invalid_format").format(", ".join(FORMATS))
+        )
+    return args
+
+
+def render(source: str, width: int, height: int, format: str, quality: int) -> bytes:
+    """
+    Scales the image down to fit in width x height(never up) and encodes it in `format`
+    :raises UnreadableImageException: when Pillow can not read the source, or it is a decompression bomb(more pixels
+        than Image.MAX_IMAGE_PIXELS, a small file that would take gigabytes of memory to decode)
+    """
+    from PIL import Image, ImageOps, UnidentifiedImageError
+
+    try:
+        image = Image.open(source)
+    except (UnidentifiedImageError, Image.DecompressionBombError) as e:
+        raise UnreadableImageException(str(e)) from e
+    with image:
+        try:
+            image.load()  # decoded now, so a truncated or corrupt file is told apart from the errors below
+        except OSError as e:
+            raise UnreadableImageException(str(e)) from e
+        image = ImageOps.exif_transpose(image)  # photos from phones are often stored sideways
+        if width or height:
+            image.thumbnail(
+                (width or image.width, height or image.height), Image.LANCZOS
+            )
+        if format == "jpeg" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")  # no alpha channel in jpeg
+        output = io.BytesIO()
+        image.save(output, PILLOW_FORMATS[format], quality=quality, optimize=True)
+        return output.getvalue()
+
+
+class DiskLRUCache:
+    def __init__(self, folder: str, max_bytes: int):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self._size = None  # bytes in the folder, counted on first use
+        self._lock = Lock()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.folder, key)
+
+    def get(self, key: str) -> Union[str, None]:
+        path = self._path(key)
+        try:
+            os.utime(path)  # the mtime is our "last used" time
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, key: str, data: bytes) -> str:
+        os.makedirs(self.folder, exist_ok=True)
+        path = self._path(key)
+        temporary = f"{path}.{uuid4().hex}.tmp"
+        with open(temporary, "wb") as f:
+            f.write(data)
+        os.replace(temporary, path)  # atomic, readers never see a half written file
+
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan()[1]
+            else:
+                self._size += len(data)
+            if self._size > self.max_bytes:
+                self._evict()
+        return path
+
+    def _scan(self) -> Tuple[list, int]:
+        files = []
+        for entry in os.scandir(self.folder):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        return files, sum(size for _, size, _ in files)
+
+    def _evict(self) -> None:
+        # down to 90% of the budget, so we do not scan the folder again on the next put
+        files, self._size = self._scan()
+        for _, size, path in sorted(files):
+            if self._size <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass  # evicted by another worker
+            self._size -= size
+
+
+class _Call:
+    def __init__(self):
+        self.done = Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls for the same key into one, the callers that arrive while it runs get its result
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+        self._lock = Lock()
+
+    def do(self, key: str, function: Callable):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class DerivativeStore:
+    def __init__(
+        self, folder: str = "image_derivatives", max_bytes: int = 256 * 1024 * 1024
+    ):
+        self.cache = DiskLRUCache(folder, max_bytes)
+        self.renders = SingleFlight()
+
+    def configure(self, config) -> None:
+        """
+        Called from app.py once the config has been loaded
+        """
+        self.cache = DiskLRUCache(
+            config.get("IMAGE_DERIVATIVE_CACHE_DIR", self.cache.folder),
+            config.get("IMAGE_DERIVATIVE_CACHE_SIZE", self.cache.max_bytes),
+        )
+
+    def get(self, source: str, source_etag: str, args: Dict) -> Tuple[str, str]:
+        """
+        The derivative of `source` described by `args`(see get_derivative_args), rendered if it is not cached yet
+        :return: (path of the derivative, its key, which also serves as its etag)
+        """
+        format = args["format"] or _source_format(source)
+        key = (
+            f"{source_etag}-{args['width']}x{args['height']}-q{args['quality']}"
+            f".{FORMATS[format]}"
+        )
+        path = self.cache.get(key)
+        if path is None:
+            path = self.renders.do(
+                key,
+                lambda: self.cache.get(key)  # rendered while we waited for the lock
+                or self.cache.put(
+                    key,
+                    render(source, args["width"], args["height"], format, args["quality"]),
+                ),
+            )
+        return path, key
+
+
+def _source_format(source: str) -> str:
+    # keep the format of the source when it is one we can write, jpeg otherwise(e.g for gif and bmp)
+    extension = os.path.splitext(source)[1][1:].lower()
+    if extension in ("jpg", "jpe"):
+        return "jpeg"
+    return extension if extension in FORMATS else "jpeg"
+
+
+derivative_store = DerivativeStore()
@@ -0,0 +1,121 @@
+import mimetypes
+import os
+from collections import OrderedDict
+from contextlib import nullcontext
+from hashlib import blake2b
+from threading import Lock
+from typing import BinaryIO
+from urllib.parse import quote
+
+from flask import current_app, request
+from werkzeug.wsgi import wrap_file
+
+from libs import image_helper
+
+"""
+libs.image_response
+
+Builds the responses of Image.get and Avatar.get so that browsers and proxies can cache them:
+- a content-hash ETag and Last-Modified, answered with 304 Not Modified when the client's copy is still current
+  (If-None-Match/If-Modified-Since), so a refresh sends no bytes
+- Range requests(206 Partial Content), a client can resume a download or fetch only part of an image
+- Cache-Control with a max-age from the config, private for the images of one user and public for avatars
+With IMAGE_OFFLOAD set, the worker only checks the request and answers with headers, the front proxy sends the file:
+    "x-accel-redirect"  nginx, IMAGE_OFFLOAD_PREFIX is an `internal` location aliased to UPLOADED_IMAGES_DEST
+    "x-sendfile"        apache mod_xsendfile, lighttpd, the header holds the absolute path of the file
+"""
+
+OFFLOAD_X_ACCEL_REDIRECT = "x-accel-redirect"
+OFFLOAD_X_SENDFILE = "x-sendfile"
+# hashing is only redone when a file's mtime or size changes
+ETAG_CACHE_SIZE = 4096
+
+_etags = OrderedDict()  # (path, mtime, size) -> etag
+_etags_lock = Lock()
+
+
+def content_etag(path: str, stat: os.stat_result, file: BinaryIO = None) -> str:
+    """
+    Hash of the file's content, remembered for as long as the file keeps the same mtime and size
+    :param file: the file already opened at `path`, it is read from and rewound instead of opening `path` again
+    """
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    with _etags_lock:
+        etag = _etags.get(key)
+        if etag is not None:
+            _etags.move_to_end(key)
+            return etag
+
+    digest = blake2b(digest_size=16)
+    with (nullcontext(file) if file is not None else open(path, "rb")) as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            digest.update(chunk)
+        if file is not None:
+            file.seek(0)
+    etag = digest.hexdigest()
+
+    with _etags_lock:
+        _etags[key] = etag
+        while len(_etags) > ETAG_CACHE_SIZE:
+            _etags.popitem(last=False)
+    return etag
+
+
+def send_image(
+    path: str,
+    etag: str,
+    size: int,
+    mtime: float,
+    max_age: int,
+    private: bool = False,
+    allow_offload: bool = True,
+):
+    """
+    :param path: full path of the image, under UPLOADED_IMAGES_DEST unless allow_offload is False
+    :param etag, size, mtime: what the caller knows of the file, the file actually opened is checked against them,
+        it may have been replaced since
+    :raises FileNotFoundError: when the file is gone, only without offload since the proxy opens the file otherwise
+    """
+    offload = current_app.config.get("IMAGE_OFFLOAD") if allow_offload else None
+    mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+    if offload == OFFLOAD_X_ACCEL_REDIRECT:
+        relative = os.path.relpath(path, image_helper.IMAGE_SET.config.destination)
+        response = current_app.response_class(mimetype=mimetype)
+        response.headers["X-Accel-Redirect"] = (
+            current_app.config["IMAGE_OFFLOAD_PREFIX"].rstrip("/") + "/" + quote(relative)
+        )
+    elif offload == OFFLOAD_X_SENDFILE:
+        response = current_app.response_class(mimetype=mimetype)
+        response.headers["X-Sendfile"] = os.path.abspath(path)
+    else:
+        file = open(path, "rb")
+        stat = os.fstat(file.fileno())
+        if (stat.st_size, stat.st_mtime) != (size, mtime):
+            # replaced after the caller looked at it, describe the file we are sending instead
+            size, mtime = stat.st_size, stat.st_mtime
+            etag = content_etag(path, stat, file)
+        response = current_app.response_class(
+            wrap_file(request.environ, file), mimetype=mimetype, direct_passthrough=True
+        )
+        response.content_length = size
+
+    response.set_etag(etag)
+    response.last_modified = mtime
+    response.cache_control.max_age = max_age
+    if private:
+        response.cache_control.private = True
+    else:
+        response.cache_control.public = True
+
+    # the proxy handles Range itself when it sends the file
+    response = response.make_conditional(
+        request, accept_ranges=not offload, complete_length=None if offload else size
+    )
+    if offload:
+        response.headers.pop("Accept-Ranges", None)  # the proxy advertises its own
+    if response.status_code == 304:
+        # some proxies would still send the file for a 304
+        response.headers.pop("X-Accel-Redirect", None)
+        response.headers.pop("X-Sendfile", None)
+    return response
@@ -0,0 +1,135 @@
+import traceback
+from threading import Event, Thread
+
+from db import db
+from libs.mailgun import Mailgun, MailGunException
+from models.outbox import OutboxEmailModel
+
+"""
+libs.mail_outbox
+
+Sends the emails queued in the email_outbox table(see models/outbox.py), so no request waits for Mailgun and a Mailgun
+outage only delays emails instead of failing registrations.
+The dispatcher claims up to `batch_size` emails sharing a template and sends them in one Mailgun request, with each
+recipient's values passed as recipient variables. When Mailgun can not be reached or answers 429/5xx the emails are
+retried with an exponential backoff, any other answer means the request itself is wrong and they are failed right away.
+Mailgun is only called once per batch, its own retries would multiply with the outbox's attempts.
+Any other error is retried the same way, and so are the claims of a dispatcher that died while sending, so no batch is
+retried forever.
+Claims are conditional UPDATEs, so the dispatchers of several processes can share the table.
+"""
+
+# Mailgun accepts up to 1000 recipients per message
+MAX_BATCH_SIZE = 1000
+
+
+class MailDispatcher:
+    def __init__(
+        self,
+        app,
+        batch_size: int = 100,
+        poll_interval: float = 1,
+        max_attempts: int = 5,
+        backoff: float = 30,
+        stale_after: int = 300,
+    ):
+        self.app = app
+        self.batch_size = min(batch_size, MAX_BATCH_SIZE)
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.stale_after = stale_after
+        self._stop = Event()
+        self._thread = None
+
+    def start(self) -> None:
+        self._thread = Thread(target=self._run, name="mail-dispatcher", daemon=True)
+        self._thread.start()
+
+    def run(self) -> None:
+        """
+        Dispatches and blocks until interrupted, used to run the dispatcher in a dedicated process
+        """
+        self.start()
+        try:
+            while not self._stop.wait(1):
+                pass
+        except KeyboardInterrupt:
+            self.stop()
+
+    def stop(self, timeout: float = None) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            with self.app.app_context():
+                try:
+                    sent = self.dispatch_batch()
+                except Exception:
+                    traceback.print_exc()
+                    sent = 0
+                finally:
+                    db.session.remove()
+            if not sent:
+                self._stop.wait(self.poll_interval)
+
+    def dispatch_batch(self) -> int:
+        """
+        Claims and sends one batch, must be called inside an app context
+        :return: the number of emails claimed, 0 when there was nothing due
+        """
+        emails = OutboxEmailModel.claim_batch(
+            self.batch_size, self.stale_after, self.max_attempts
+        )
+        if not emails:
+            return 0
+
+        first = emails[0]
+        try:
+            Mailgun.send_batch(
+                [email.recipient for email in emails],
+                first.subject,
+                first.text,
+                first.html,
+                {email.recipient: email.recipient_variables for email in emails},
+                max_retries=0,  # single shot, the retries are the outbox's own backoff below
+            )
+        except MailGunException as e:
+            if e.status_code is None or e.status_code == 429 or e.status_code >= 500:
+                OutboxEmailModel.retry_batch(emails, str(e), self.max_attempts, self.backoff)
+            else:
+                OutboxEmailModel.fail_batch(emails, str(e))
+            return len(emails)
+        except Exception as e:
+            # a bug or bad data, retried like an outage so that it ends up failed after max_attempts
+            traceback.print_exc()
+            db.session.rollback()
+            OutboxEmailModel.retry_batch(emails, repr(e), self.max_attempts, self.backoff)
+            return len(emails)
+
+        OutboxEmailModel.delete_batch(emails)
+        return len(emails)
+
+
+mail_dispatcher = None
+
+
+def start_mail_dispatcher(app) -> MailDispatcher:
+    global mail_dispatcher
+    if mail_dispatcher is None:
+        mail_dispatcher = create_mail_dispatcher(app)
+        mail_dispatcher.start()
+    return mail_dispatcher
+
+
+def create_mail_dispatcher(app) -> MailDispatcher:
+    return MailDispatcher(
+        app,
+        batch_size=app.config.get("MAIL_BATCH_SIZE", 100),
+        poll_interval=app.config.get("MAIL_POLL_INTERVAL", 1),
+        max_attempts=app.config.get("MAIL_MAX_ATTEMPTS", 5),
+        backoff=app.config.get("MAIL_RETRY_BACKOFF", 30),
+    )
@@ -1,8 +1,16 @@
+import json
 import os
-from typing import List
-from requests import Response, post
+import random
+from threading import Lock
+from time import monotonic, sleep
+from typing import Dict, List
+from requests import Response, Session
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError, ConnectTimeout, RequestException
+from urllib3.exceptions import NewConnectionError
 
 # # Absolute import
+from libs.metrics import Counters, LatencyHistogram
 from libs.strings import gettext
 
 # # Relative import
@@ -11,23 +19,95 @@ from libs.strings import gettext
 # Error handling in Mailgun
 class MailGunException(Exception):
     # takes in a message and call the super class init method with that message
-    def __init__(self, message: str):
+    # status_code is the status Mailgun answered with, None when it could not be reached
+    def __init__(self, message: str, status_code: int = None):
         super().__init__(message)
+        self.status_code = status_code
 
 
 # creating our own mailgun library
 class Mailgun:
+    """
+    All the requests go through one keep-alive Session shared by every thread, so sending an email reuses a pooled
+    connection instead of a new TCP and TLS handshake. Each request has connect/read timeouts, 429 and 5xx answers
+    (and connections that could not be opened: connect timeouts, refused connections, DNS failures) are retried up to
+    MAX_RETRIES times after a jittered exponential backoff. Other failures are not retried, Mailgun may already have
+    accepted the message.
+    """
 
     MAILGUN_API_KEY = os.environ.get("MAILGUN_API_KEY", None)
     MAILGUN_DOMAIN = os.environ.get("MAILGUN_DOMAIN", None)
+    # can point at a local fake Mailgun(see resources/fake_mailgun.py) or any other stub server
+    MAILGUN_API_BASE = os.environ.get("MAILGUN_API_BASE", "https://api.mailgun.net/v3")
 
     FROM_TITLE = "Stores REST API"
     FROM_EMAIL = f"do-not-reply@{MAILGUN_DOMAIN}"
 
+    # overridden from the app config by configure()
+    CONNECT_TIMEOUT = 5  # seconds
+    READ_TIMEOUT = 30  # seconds
+    POOL_SIZE = 10  # keep-alive connections
+    MAX_RETRIES = 3
+    RETRY_BACKOFF = 0.5  # seconds, doubled for every retry
+    MAX_RETRY_DELAY = 10  # seconds
+
+    latency = LatencyHistogram()
+    counters = Counters()
+    _session = None
+    _session_lock = Lock()
+
     @classmethod
-    def send_email(
-        cls, email: List[str], subject: str, text: str, html: str
+    def configure(cls, config) -> None:
+        """
+        Called from app.py once the config has been loaded
+        """
+        cls.CONNECT_TIMEOUT = config.get("MAILGUN_CONNECT_TIMEOUT", cls.CONNECT_TIMEOUT)
+        cls.READ_TIMEOUT = config.get("MAILGUN_READ_TIMEOUT", cls.READ_TIMEOUT)
+        cls.POOL_SIZE = config.get("MAILGUN_POOL_SIZE", cls.POOL_SIZE)
+        cls.MAX_RETRIES = config.get("MAILGUN_MAX_RETRIES", cls.MAX_RETRIES)
+        cls.RETRY_BACKOFF = config.get("MAILGUN_RETRY_BACKOFF", cls.RETRY_BACKOFF)
+        with cls._session_lock:
+            cls._session = None  # rebuilt with the new pool size
+
+    @classmethod
+    def _get_session(cls) -> Session:
+        with cls._session_lock:
+            if cls._session is None:
+                session = Session()
+                adapter = HTTPAdapter(pool_maxsize=cls.POOL_SIZE)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                cls._session = session
+            return cls._session
+
+    @classmethod
+    def _retry_delay(cls, attempt: int, response: Response = None) -> float:
+        # "full jitter", spreads out the retries of workers that failed at the same time
+        delay = random.uniform(0, min(cls.MAX_RETRY_DELAY, cls.RETRY_BACKOFF * 2 ** attempt))
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, min(cls.MAX_RETRY_DELAY, int(retry_after)))
+        return delay
+
+    @staticmethod
+    def _not_sent(error: RequestException) -> bool:
+        """
+        True when the connection could not be opened, so nothing reached Mailgun and retrying is safe
+        """
+        if isinstance(error, ConnectTimeout):
+            return True
+        reason = getattr(error.args[0], "reason", None) if error.args else None
+        return isinstance(error, ConnectionError) and isinstance(reason, NewConnectionError)
+
+    @classmethod
+    def _post_message(
+        cls, data: Dict, error_message: str, max_retries: int = None
     ) -> Response:
+        """
+        :param max_retries: overrides MAX_RETRIES, 0 for callers that retry on their own(see libs/mail_outbox.py)
+        """
+        if max_retries is None:
+            max_retries = cls.MAX_RETRIES
 
         if cls.MAILGUN_API_KEY is None:
             raise MailGunException(gettext("mailgun_failed_load_api_key"))
@@ -35,23 +115,89 @@ class Mailgun:
         if cls.MAILGUN_DOMAIN is None:
             raise MailGunException(gettext("mailgun_failed_load_domain"))
 
+        url = f"{cls.MAILGUN_API_BASE}/{cls.MAILGUN_DOMAIN}/messages"
+        data = {"from": f"{cls.FROM_TITLE} <{cls.FROM_EMAIL}>", **data}
+        session = cls._get_session()
+        attempt = 0
+        while True:
+            started = monotonic()
+            try:
+                response = session.post(
+                    url,
+                    auth=("api", cls.MAILGUN_API_KEY),
+                    data=data,
+                    timeout=(cls.CONNECT_TIMEOUT, cls.READ_TIMEOUT),
+                )
+            except RequestException as e:
+                if not cls._not_sent(e):
+                    cls.counters.increment("failed")
+                    raise MailGunException(str(e))
+                response, error = None, e  # nothing was sent, safe to retry
+            finally:
+                cls.latency.observe(monotonic() - started)
+
+            if response is not None:
+                if response.status_code == 200:
+                    cls.counters.increment("sent")
+                    return response
+                if response.status_code != 429 and response.status_code < 500:
+                    cls.counters.increment("rejected")
+                    raise MailGunException(
+                        error_message.format(response.status_code), response.status_code
+                    )
+
+            if attempt >= max_retries:
+                cls.counters.increment("failed")
+                if response is None:
+                    raise MailGunException(str(error))
+                raise MailGunException(
+                    error_message.format(response.status_code), response.status_code
+                )
+            cls.counters.increment("retried")
+            sleep(cls._retry_delay(attempt, response))
+            attempt += 1
+
+    @classmethod
+    def send_email(
+        cls, email: List[str], subject: str, text: str, html: str
+    ) -> Response:
+
         # # sending request to the mailgun API
-        response = post(
-            f"https://api.mailgun.net/v3/{cls.MAILGUN_DOMAIN}/messages",
-            auth=("api", cls.MAILGUN_API_KEY),
-            data={
-                "from": f"{cls.FROM_TITLE} <{cls.FROM_EMAIL}>",
-                "to": email,
+        return cls._post_message(
+            {"to": email, "subject": subject, "text": text, "html": html},
+            gettext("mailgun_error_send_email"),
+        )
+
+    @classmethod
+    def send_batch(
+        cls,
+        emails: List[str],
+        subject: str,
+        text: str,
+        html: str,
+        recipient_variables: Dict[str, Dict[str, str]],
+        max_retries: int = None,
+    ) -> Response:
+        """
+        Sends one message to up to 1000 recipients, each one only sees their own address in the "to" header.
+        %recipient.<name>% in subject/text/html is replaced by recipient_variables[email][name], so an address must
+        not be in `emails` twice
+        """
+        return cls._post_message(
+            {
+                "to": emails,
                 "subject": subject,
                 "text": text,
                 "html": html,
+                "recipient-variables": json.dumps(recipient_variables),
             },
+            gettext("mailgun_error_send_batch"),
+            max_retries,
         )
 
-        if response.status_code != 200:
-            raise MailGunException(gettext("mailgun_error_send_email"))
-
-        return response
+    @classmethod
+    def stats(cls) -> Dict:
+        return {"calls": cls.counters.snapshot(), "latency": cls.latency.snapshot()}
 
 
 """
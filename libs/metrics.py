@@ -0,0 +1,58 @@
+from bisect import bisect_left
+from threading import Lock
+from typing import Dict, List
+
+"""
+libs.metrics
+
+Small in-process metrics for the clients of external services(Stripe, Mailgun...), read back through their admin
+stats endpoints
+"""
+
+# upper bounds of the latency buckets in milliseconds, anything slower goes to the "+inf" bucket
+DEFAULT_LATENCY_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class LatencyHistogram:
+    def __init__(self, buckets: List[float] = DEFAULT_LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._total = 0.0
+        self._count = 0
+        self._lock = Lock()
+
+    def observe(self, seconds: float) -> None:
+        milliseconds = seconds * 1000
+        with self._lock:
+            self._counts[bisect_left(self.buckets, milliseconds)] += 1
+            self._total += milliseconds
+            self._count += 1
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            counts = list(self._counts)
+            total, count = self._total, self._count
+        labels = [f"<={bound}ms" for bound in self.buckets] + ["+inf"]
+        return {
+            "count": count,
+            "mean_ms": round(total / count, 2) if count else None,
+            "buckets": dict(zip(labels, counts)),
+        }
+
+
+class Counters:
+    """
+    Named counters, e.g calls, errors, retries
+    """
+
+    def __init__(self):
+        self._values: Dict[str, int] = {}
+        self._lock = Lock()
+
+    def increment(self, name: str, by: int = 1) -> None:
+        with self._lock:
+            self._values[name] = self._values.get(name, 0) + by
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._values)
@@ -0,0 +1,72 @@
+from typing import List, Tuple, Union
+from flask import request
+
+from libs.strings import gettext
+
+"""
+libs.pagination
+
+Keyset(cursor) pagination helpers shared by the list endpoints.
+Instead of OFFSET, which makes the database walk and throw away every skipped row, we remember the last id a client
+has seen and ask for rows strictly after it, e.g `WHERE id > :after ORDER BY id LIMIT :limit`
+This is a single range scan on the primary key index no matter how deep into the table the client has paged
+"""
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+class PaginationException(Exception):
+    def __init__(self, message: str):
+        super().__init__(message)
+
+
+def is_paginated() -> bool:
+    """
+    The paginated mode is opt-in, so clients that do not send ?limit= or ?after= keep getting the full list
+    """
+    return "limit" in request.args or "after" in request.args
+
+
+def get_page_args() -> Tuple[int, Union[int, None]]:
+    """
+    Reads and validates ?limit= and ?after= from the current request
+    :return: (limit, after) where after is None for the first page
+    """
+    try:
+        limit = int(request.args.get("limit", DEFAULT_PAGE_SIZE))
+    except ValueError:
+        limit = 0
+    if not 0 < limit <= MAX_PAGE_SIZE:
+        raise PaginationException(
+            gettext("pagination_invalid_limit").format(MAX_PAGE_SIZE)
+        )
+
+    after = None
+    if "after" in request.args:
+        try:
+            after = int(request.args["after"])
+        except ValueError:
+            raise PaginationException(gettext("pagination_invalid_cursor"))
+
+    return limit, after
+
+
+def keyset_page(
+    query, column, limit: int, after: int = None, descending: bool = False
+) -> Tuple[List, Union[int, None]]:
+    """
+    Fetches one page of `query` ordered by `column`, starting strictly after the `after` cursor
+    one extra row is fetched so we know whether there is a next page without issuing a COUNT(*)
+    :param descending: page from the highest value down, e.g newest first when paging on an autoincrement id
+    :return: (rows, next) where next is the cursor to send back as ?after= or None on the last page
+    """
+    if after is not None:
+        query = query.filter(column < after if descending else column > after)
+    order = column.desc() if descending else column
+    rows = query.order_by(order).limit(limit + 1).all()
+
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, getattr(rows[-1], column.key)
+    return rows, None
@@ -0,0 +1,104 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from threading import Lock
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+"""
+libs.passwords
+
+Password hashes are deliberately expensive(PBKDF2 with `iterations` rounds), computing them on the request thread
+holds up that worker for the whole hash. PasswordHasher runs them in a pool of `workers` processes instead, so a burst
+of logins is spread over several cores while the request threads just wait for the result.
+Every web worker(gunicorn process) has its own pool, keep `workers` times the number of web workers within the number
+of cores. workers=0 hashes on the request thread.
+The pool processes are started from a clean forkserver(or spawn) process rather than forked from the web worker, which
+already runs the charge, mail and periodic threads by then. A pool whose process died is replaced on the next call.
+
+The work factor lives in the hash itself(pbkdf2:sha256:150000$salt$hash), when PASSWORD_HASH_ITERATIONS is raised the
+existing hashes are upgraded the next time their user logs in, see needs_rehash().
+"""
+
+
+class PasswordHasher:
+    def __init__(
+        self,
+        algorithm: str = "sha256",
+        iterations: int = 150_000,
+        salt_length: int = 16,
+        workers: int = 2,
+    ):
+        self.method = f"pbkdf2:{algorithm}:{iterations}"
+        self.salt_length = salt_length
+        self.workers = workers
+        self._pool = None
+        self._pool_pid = None
+        self._lock = Lock()
+
+    def _run(self, function, *args):
+        if self.workers <= 0:
+            return function(*args)
+        pool = self._get_pool()
+        try:
+            return pool.submit(function, *args).result()
+        except BrokenProcessPool:
+            # a pool process was killed(OOM killer, kill -9), the whole pool is unusable now, start a new one
+            return self._get_pool(broken=pool).submit(function, *args).result()
+
+    def _get_pool(self, broken: ProcessPoolExecutor = None) -> ProcessPoolExecutor:
+        with self._lock:
+            # started lazily and again after a fork, gunicorn forks its workers after importing the app
+            if self._pool is None or self._pool_pid != os.getpid() or self._pool is broken:
+                if self._pool is not None and self._pool_pid == os.getpid():
+                    self._pool.shutdown(wait=False)
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=_pool_context()
+                )
+                self._pool_pid = os.getpid()
+            return self._pool
+
+    def hash(self, password: str) -> str:
+        return self._run(generate_password_hash, password, self.method, self.salt_length)
+
+    def verify(self, pwhash: str, password: str) -> bool:
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash: str) -> bool:
+        """
+        Whether a hash was made with other parameters than the current ones, only call this once the password has
+        been verified, the new hash needs the plaintext password
+        """
+        if pwhash.count("$") < 2:
+            return True  # unsalted legacy hash
+        method, salt, _ = pwhash.split("$", 2)
+        return method != self.method or len(salt) < self.salt_length
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+
+
+def _pool_context():
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+password_hasher = PasswordHasher()
+
+
+def configure_password_hasher(config) -> None:
+    """
+    Called from app.py once the config has been loaded
+    """
+    global password_hasher
+    password_hasher.shutdown()
+    password_hasher = PasswordHasher(
+        algorithm=config.get("PASSWORD_HASH_ALGORITHM", "sha256"),
+        iterations=config.get("PASSWORD_HASH_ITERATIONS", 150_000),
+        salt_length=config.get("PASSWORD_HASH_SALT_LENGTH", 16),
+        workers=config.get("PASSWORD_HASH_WORKERS", 2),
+    )
@@ -0,0 +1,246 @@
+import os
+from time import monotonic, sleep, time
+from typing import Dict, Union
+from uuid import uuid4
+
+import stripe
+from requests import Session
+from requests.adapters import HTTPAdapter
+
+from libs.circuit_breaker import CircuitBreaker, OPEN
+from libs.metrics import Counters, LatencyHistogram
+from libs.strings import gettext
+
+"""
+libs.payments
+
+The one place we talk to Stripe from, OrderModel.charge_with_stripe() goes through `payment_client`.
+StripeClient keeps one keep-alive connection pool to Stripe with connect/read timeouts, fails fast through a circuit
+breaker while Stripe is degraded and records the latency of every call.
+FakeStripeClient answers like Stripe without any network access so that checkout can be load-tested offline,
+it is selected with STRIPE_FAKE=True in the config. STRIPE_API_BASE points the real client at a local stub server.
+Charges made for an order carry its charge key(OrderModel.charge_key) in their metadata and as their Stripe idempotency
+key, so that the crash recovery sweep can ask Stripe whether a pending order was charged before failing it, see
+find_charge().
+"""
+
+# errors meaning Stripe itself is in trouble, a declined card or a bad request says nothing about Stripe's health
+BREAKER_ERRORS = (
+    stripe.error.APIConnectionError,
+    stripe.error.APIError,
+    stripe.error.RateLimitError,
+)
+
+
+class PaymentCircuitOpenError(stripe.error.APIConnectionError):
+    def __init__(self):
+        message = gettext("payment_circuit_open")
+        super().__init__(message, http_status=503, json_body={"message": message})
+
+
+class StripeClient:
+    def __init__(
+        self,
+        api_key: str = None,
+        api_base: str = None,
+        connect_timeout: float = 5,
+        read_timeout: float = 30,
+        pool_size: int = 10,
+        max_network_retries: int = 0,
+        breaker: CircuitBreaker = None,
+    ):
+        # Set your secret key: remember to change this to your live secret key in production
+        # See your keys here: https://dashboard.stripe.com/account/apikeys
+        self.api_key = api_key or os.getenv("STRIPE_API_KEY")
+        self.breaker = breaker or CircuitBreaker()
+        self.latency = LatencyHistogram()
+        self.counters = Counters()
+
+        # one session shared by all threads, its pool keeps up to pool_size connections to Stripe alive
+        session = Session()
+        session.mount("https://", HTTPAdapter(pool_maxsize=pool_size))
+        session.mount("http://", HTTPAdapter(pool_maxsize=pool_size))
+        # the stripe library only supports a process wide http client
+        stripe.default_http_client = stripe.http_client.RequestsClient(
+            timeout=(connect_timeout, read_timeout), session=session
+        )
+        # timeouts, connection errors and 5xx answers are retried by the library with exponential backoff and jitter,
+        # under the same idempotency key so a retried charge is never made twice
+        stripe.max_network_retries = max_network_retries
+        if api_base:
+            stripe.api_base = api_base
+
+    def create_charge(
+        self,
+        amount: int,
+        currency: str,
+        description: str,
+        source: str,
+        order_id: int = None,
+        order_key: str = None,
+    ) -> stripe.Charge:
+        if not self.breaker.allow():
+            self.counters.increment("rejected")
+            raise PaymentCircuitOpenError()
+
+        order = {}
+        if order_key is not None:
+            order = {
+                "metadata": {"order_id": str(order_id), "order_key": order_key},
+                "idempotency_key": order_key,  # an order is never charged twice
+            }
+        started = monotonic()
+        succeeded = False  # a call that raises anything unexpected counts as a failure
+        try:
+            charge = stripe.Charge.create(
+                api_key=self.api_key,
+                amount=amount,  # amount in us dollar cent/nigerian kobo we want to charge
+                currency=currency,
+                description=description,
+                source=source,
+                **order,
+            )
+            succeeded = True
+            self.counters.increment("succeeded")
+            return charge
+        except BREAKER_ERRORS:
+            self.counters.increment("failed")
+            raise
+        except stripe.error.StripeError:
+            succeeded = True  # declined or rejected, Stripe itself answered fine
+            self.counters.increment("declined")
+            raise
+        except Exception:
+            self.counters.increment("failed")
+            raise
+        finally:
+            # always reported, otherwise a half-open breaker would wait for its trial call forever
+            if succeeded:
+                self.breaker.record_success()
+            else:
+                self.breaker.record_failure()
+            self.latency.observe(monotonic() - started)
+
+    def find_charge(self, order_key: str) -> Union[stripe.Charge, None]:
+        """
+        The charge made for an order, one call to Stripe's charge search on the order key in its metadata.
+        Search results can lag the charges by about a minute, the orders looked up are pending for much longer.
+        The stripe library we use has no Charge.search yet, the endpoint is called through its requestor.
+        :raises stripe.error.StripeError: when Stripe could not be asked, the order's outcome is unknown then
+        """
+        if self.breaker.state == OPEN:
+            raise PaymentCircuitOpenError()  # without taking the half-open trial call, that is left to a charge
+        response, api_key = stripe.api_requestor.APIRequestor(key=self.api_key).request(
+            "get",
+            "/v1/charges/search",
+            {"query": f"metadata['order_key']:'{order_key}'", "limit": 1},
+        )
+        charges = stripe.util.convert_to_stripe_object(response, api_key)
+        return charges.data[0] if charges.data else None
+
+    def stats(self) -> Dict:
+        return {
+            "client": type(self).__name__,
+            "circuit_breaker": self.breaker.snapshot(),
+            "calls": self.counters.snapshot(),
+            "latency": self.latency.snapshot(),
+        }
+
+
+class FakeStripeClient:
+    """
+    Uses the same test tokens as Stripe, tok_chargeDeclined is declined and anything else is charged
+    after `latency` seconds
+    """
+
+    DECLINED_TOKENS = {
+        "tok_chargeDeclined",
+        "tok_chargeDeclinedInsufficientFunds",
+        "tok_chargeDeclinedExpiredCard",
+    }
+
+    def __init__(self, latency: float = 0.0):
+        self.delay = latency
+        self.counters = Counters()
+        self.charges = {}  # order key -> charge
+
+    def stats(self) -> Dict:
+        return {"client": type(self).__name__, "calls": self.counters.snapshot()}
+
+    def find_charge(self, order_key: str) -> Union[stripe.Charge, None]:
+        return self.charges.get(order_key)
+
+    def create_charge(
+        self,
+        amount: int,
+        currency: str,
+        description: str,
+        source: str,
+        order_id: int = None,
+        order_key: str = None,
+    ) -> stripe.Charge:
+        sleep(self.delay)
+        if source in self.DECLINED_TOKENS:
+            self.counters.increment("declined")
+            body = {
+                "error": {
+                    "type": "card_error",
+                    "code": "card_declined",
+                    "message": "Your card was declined.",
+                }
+            }
+            raise stripe.error.CardError(
+                body["error"]["message"],
+                None,
+                "card_declined",
+                http_body=None,
+                http_status=402,
+                json_body=body,
+            )
+
+        self.counters.increment("succeeded")
+        charge = stripe.Charge.construct_from(
+            {
+                "id": f"ch_fake_{uuid4().hex}",
+                "object": "charge",
+                "amount": amount,
+                "currency": currency,
+                "description": description,
+                "metadata": {}
+                if order_key is None
+                else {"order_id": str(order_id), "order_key": order_key},
+                "paid": True,
+                "status": "succeeded",
+                "created": int(time()),
+            },
+            "sk_fake",
+        )
+        if order_key is not None:
+            self.charges[order_key] = charge
+            if len(self.charges) > 10000:
+                self.charges.pop(next(iter(self.charges)))  # the oldest, only recent orders are ever looked up
+        return charge
+
+
+payment_client = StripeClient()
+
+
+def configure_payment_client(config) -> None:
+    """
+    Picks the client from the app config, called from app.py once the config has been loaded
+    """
+    global payment_client
+    if config.get("STRIPE_FAKE"):
+        payment_client = FakeStripeClient(config.get("STRIPE_FAKE_LATENCY", 0.0))
+    else:
+        payment_client = StripeClient(
+            api_base=config.get("STRIPE_API_BASE"),
+            connect_timeout=config.get("STRIPE_CONNECT_TIMEOUT", 5),
+            read_timeout=config.get("STRIPE_READ_TIMEOUT", 30),
+            pool_size=config.get("STRIPE_POOL_SIZE", 10),
+            max_network_retries=config.get("STRIPE_MAX_NETWORK_RETRIES", 0),
+            breaker=CircuitBreaker(
+                config.get("STRIPE_BREAKER_FAILURES", 5),
+                config.get("STRIPE_BREAKER_RESET", 30),
+            ),
+        )
@@ -0,0 +1,42 @@
+import traceback
+from threading import Event, Thread
+from typing import Callable
+
+from db import db
+
+"""
+libs.periodic
+
+Runs a housekeeping function every `interval` seconds in a background thread of the web worker, inside an app context.
+Used for the jobs that only delete rows nobody needs anymore, running them in several workers at once is harmless.
+"""
+
+
+class PeriodicJob:
+    def __init__(self, app, function: Callable, interval: float, name: str = None):
+        self.app = app
+        self.function = function
+        self.interval = interval
+        self.name = name or function.__name__
+        self._stop = Event()
+        self._thread = None
+
+    def start(self) -> None:
+        self._thread = Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = None) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            with self.app.app_context():
+                try:
+                    self.function()
+                except Exception:
+                    traceback.print_exc()
+                finally:
+                    db.session.remove()
@@ -0,0 +1,212 @@
+from functools import wraps
+from math import ceil
+from threading import Lock
+from time import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from flask import current_app, request
+
+from libs.strings import gettext
+
+"""
+libs.rate_limit
+
+Admission control for the endpoints an attacker can hammer without a token(login, register, refresh), the requests
+over the limit are answered with 429 and a Retry-After header before any password is hashed or any query is made.
+
+Limits are sliding windows, approximated the usual way with two fixed windows: the count of the previous window is
+weighted by how much of it still overlaps the sliding window, e.g. 30s into a 60s window
+    count = previous * 0.5 + current
+This needs two counters per key instead of a timestamp per request and gives no burst at the window boundary.
+All the limits of a request(e.g per ip and per username) are checked before any of them is counted, rejected requests
+are not counted, a client that backs off for Retry-After seconds gets through.
+
+Clients are told apart by request.remote_addr, behind a reverse proxy that is the proxy's address unless
+TRUSTED_PROXY_COUNT is set(see app.py) so that it is taken from X-Forwarded-For instead.
+The in-memory backend is per worker, set RATE_LIMIT_REDIS_URL to share the counters between gunicorn workers.
+"""
+
+Limits = List[Tuple[str, int, int]]  # (key, limit, window)
+
+
+def _retry_after(previous: int, current: int, limit: int, window: int, elapsed: float) -> float:
+    """
+    Seconds until one more request fits in the sliding window, 0 if it fits now
+    """
+    if previous * (1 - elapsed / window) + current + 1 <= limit:
+        return 0
+    if current + 1 <= limit:
+        # wait until enough of the previous window has slid out
+        return window * (1 - (limit - current - 1) / previous) - elapsed
+    # wait for the next window, where the current count becomes the previous one
+    return window - elapsed + window * (1 - (limit - 1) / current)
+
+
+class MemoryRateLimitBackend:
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self._counters = {}  # key -> [window number, previous count, current count], least recently hit first
+        self._lock = Lock()
+
+    def hit(self, limits: Limits) -> float:
+        now = time()
+        with self._lock:
+            counters, retry_after = [], 0
+            for key, limit, window in limits:
+                number, elapsed = divmod(now, window)
+                counter = self._counter(key, number)
+                counters.append(counter)
+                retry_after = max(
+                    retry_after, _retry_after(counter[1], counter[2], limit, window, elapsed)
+                )
+            if not retry_after:
+                for counter in counters:
+                    counter[2] += 1
+            return retry_after
+
+    def _counter(self, key: str, number: float) -> list:
+        counter = self._counters.pop(key, None)
+        if counter is None:
+            if len(self._counters) >= self.max_keys:
+                self._prune(number)
+            counter = [number, 0, 0]
+        elif counter[0] != number:
+            # the window moved on, the previous window is empty if we skipped one
+            previous = counter[2] if counter[0] == number - 1 else 0
+            counter[:] = [number, previous, 0]
+        self._counters[key] = counter  # (re)inserted last, the dict stays in least recently hit order
+        return counter
+
+    def _prune(self, number: float) -> None:
+        # counters older than the previous window count for nothing anymore
+        for key in [key for key, counter in self._counters.items() if counter[0] < number - 1]:
+            del self._counters[key]
+        # still full of live counters(e.g a flood of new ips), drop the least recently hit ones
+        while len(self._counters) >= self.max_keys:
+            del self._counters[next(iter(self._counters))]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._counters.clear()
+
+
+class RedisRateLimitBackend:
+    """
+    Shared backend, redis is an optional dependency so it is only imported when this backend is configured
+    """
+
+    PREFIX = "rate:"
+
+    def __init__(self, url: str):
+        import redis
+
+        self._client = redis.Redis.from_url(url)
+
+    def hit(self, limits: Limits) -> float:
+        now = time()
+        pipeline = self._client.pipeline()
+        current_keys = []
+        for key, limit, window in limits:
+            number = int(now // window)
+            current_key = f"{self.PREFIX}{key}:{number}"
+            current_keys.append(current_key)
+            pipeline.get(f"{self.PREFIX}{key}:{number - 1}")
+            pipeline.incr(current_key)
+            pipeline.expire(current_key, window * 2)
+        results = pipeline.execute()
+
+        # counted optimistically so that concurrent workers can not all slip in, taken back when rejected
+        retry_after = 0
+        for number, (key, limit, window) in enumerate(limits):
+            previous, current = results[number * 3], results[number * 3 + 1]
+            retry_after = max(
+                retry_after,
+                _retry_after(int(previous or 0), current - 1, limit, window, now % window),
+            )
+        if retry_after:
+            pipeline = self._client.pipeline()
+            for current_key in current_keys:
+                pipeline.decr(current_key)
+            pipeline.execute()
+        return retry_after
+
+    def clear(self) -> None:
+        for key in self._client.scan_iter(self.PREFIX + "*"):
+            self._client.delete(key)
+
+
+class RateLimiter:
+    def __init__(self, backend=None):
+        self.backend = backend or MemoryRateLimitBackend()
+        self.enabled = True
+
+    def hit(self, limits: Limits) -> float:
+        """
+        Counts a request against all of its limits, or against none of them if one is exceeded
+        :param limits: (key, limit, window) of each limit, the key names the limit and what it counts(an ip...)
+        :return: 0 if the request is allowed, otherwise the seconds to wait before retrying
+        """
+        if not self.enabled or not limits:
+            return 0
+        return self.backend.hit(limits)
+
+
+rate_limiter = RateLimiter()
+
+
+def _client_ip() -> Optional[str]:
+    return request.remote_addr
+
+
+def _username() -> Optional[str]:
+    username = (request.get_json(silent=True) or {}).get("username")
+    return username.lower() if isinstance(username, str) else None
+
+
+# what each kind of limit is keyed on, a limit is skipped when the request has no such key
+LIMIT_KEYS: Dict[str, Callable[[], Optional[str]]] = {
+    "ip": _client_ip,
+    "username": _username,
+}
+
+
+def rate_limited(name: str):
+    """
+    Applies the limits configured for `name` in RATE_LIMITS to a resource method, e.g.
+        RATE_LIMITS = {"login": {"ip": (20, 60), "username": (5, 60)}}
+    allows 20 logins a minute from one ip and 5 a minute for one username
+    """
+
+    def decorator(function: Callable) -> Callable:
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            configured = current_app.config.get("RATE_LIMITS", {}).get(name, {})
+            limits = []
+            for kind, (limit, window) in configured.items():
+                key = LIMIT_KEYS[kind]()
+                if key is not None:
+                    limits.append((f"{name}:{kind}:{key}", limit, window))
+            retry_after = rate_limiter.hit(limits)
+            if retry_after:
+                seconds = ceil(retry_after)
+                return (
+                    {"message": gettext("rate_limited").format(seconds)},
+                    429,
+                    {"Retry-After": str(seconds)},
+                )
+            return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def configure_rate_limiter(config) -> None:
+    """
+    Picks the backend from the app config, called from app.py once the config has been loaded
+    """
+    rate_limiter.enabled = config.get("RATE_LIMIT_ENABLED", True)
+    if config.get("RATE_LIMIT_REDIS_URL"):
+        rate_limiter.backend = RedisRateLimitBackend(config["RATE_LIMIT_REDIS_URL"])
+    else:
+        rate_limiter.backend = MemoryRateLimitBackend()
@@ -0,0 +1,142 @@
+from hashlib import blake2b
+from math import ceil, log
+from threading import Lock
+from time import monotonic
+from typing import Iterable
+
+from sqlalchemy.exc import IntegrityError
+
+from db import db
+from models.revoked_token import RevokedTokenModel
+
+"""
+libs.revocation
+
+Revoked JWTs are stored in the revoked_tokens table so every gunicorn worker sees them, and each row is pruned once
+the token it revokes has expired, since an expired token is rejected anyway.
+
+Checking the table on every request would cost a query per request, so each worker keeps a Bloom filter of the
+revoked jtis in memory. A jti that is not in the filter is certainly not revoked, which is the answer for almost every
+request, only the rare "maybe" is confirmed against the table.
+Every `sync_interval` seconds a worker adds the revocations made since it last looked(by other workers too) to its
+filter, so a logout is honoured by the other workers within that interval. "Since" is by created_at, going back
+SYNC_OVERLAP seconds before the newest revocation seen so far, so rows committed late(a slow transaction) or stamped
+by a worker whose clock is a little behind are still picked up. The filter is rebuilt from the table every
+`rebuild_interval` seconds, which drops the pruned jtis. Pruning is left to a periodic job(see prune()), not to the
+request that happens to trigger a rebuild.
+"""
+
+NEVER_EXPIRES = 2 ** 31 - 1
+SYNC_OVERLAP = 30  # seconds
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.size = max(8, ceil(-capacity * log(error_rate) / log(2) ** 2))  # bits
+        self.hashes = max(1, round(self.size / capacity * log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key: str) -> Iterable[int]:
+        digest = blake2b(key.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "big")
+        second = int.from_bytes(digest[8:], "big")
+        # double hashing, gives `hashes` independent enough positions from one digest
+        return ((first + n * second) % self.size for n in range(self.hashes))
+
+    def add(self, key: str) -> None:
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(
+            self._bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(key)
+        )
+
+
+class RevocationStore:
+    def __init__(
+        self,
+        sync_interval: float = 1,
+        rebuild_interval: float = 300,
+        capacity: int = 100_000,
+        error_rate: float = 0.001,
+    ):
+        self.sync_interval = sync_interval
+        self.rebuild_interval = rebuild_interval
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self._bloom = BloomFilter(capacity, error_rate)
+        self._watermark = 0  # newest created_at seen
+        self._recent = {}  # jti -> created_at of the revocations within SYNC_OVERLAP of the watermark
+        self._synced_at = None
+        self._rebuilt_at = None
+        self._lock = Lock()
+
+    def configure(self, config) -> None:
+        """
+        Called from app.py once the config has been loaded
+        """
+        self.sync_interval = config.get("REVOCATION_SYNC_INTERVAL", self.sync_interval)
+        self.rebuild_interval = config.get(
+            "REVOCATION_REBUILD_INTERVAL", self.rebuild_interval
+        )
+
+    def add(self, jti: str, expires_at: int = None) -> None:
+        """
+        Revokes a token until `expires_at`(the token's exp claim), tokens without an expiry are revoked forever
+        """
+        try:
+            revoked = RevokedTokenModel(jti=jti, expires_at=expires_at or NEVER_EXPIRES)
+            revoked.save_to_db()
+        except IntegrityError:
+            db.session.rollback()  # already revoked
+        with self._lock:
+            self._bloom.add(jti)
+
+    def __contains__(self, jti: str) -> bool:
+        self._sync()
+        if jti not in self._bloom:
+            return False
+        return RevokedTokenModel.find_by_jti(jti) is not None
+
+    def _sync(self) -> None:
+        now = monotonic()
+        if self._synced_at is not None and now - self._synced_at < self.sync_interval:
+            return
+        with self._lock:
+            if self._synced_at is not None and now - self._synced_at < self.sync_interval:
+                return  # another thread synced while we waited for the lock
+            if self._rebuilt_at is None or now - self._rebuilt_at >= self.rebuild_interval:
+                self._rebuild()
+                self._rebuilt_at = now
+            else:
+                self._fill(self._bloom)
+            self._synced_at = now
+
+    def _fill(self, bloom: BloomFilter) -> None:
+        for created_at, jti in RevokedTokenModel.find_since(self._watermark - SYNC_OVERLAP):
+            if jti not in self._recent:  # seen by the previous sync already, the overlap reads them again
+                bloom.add(jti)
+                self._recent[jti] = created_at
+            self._watermark = max(self._watermark, created_at)
+        cutoff = self._watermark - SYNC_OVERLAP
+        self._recent = {jti: at for jti, at in self._recent.items() if at >= cutoff}
+
+    def _rebuild(self) -> None:
+        # grow the filter before it gets past its capacity and its error rate climbs
+        bloom = BloomFilter(max(self.capacity, self._bloom.count * 2), self.error_rate)
+        # filled before it replaces the current one, readers never see a half empty filter
+        self._watermark, self._recent = 0, {}
+        self._fill(bloom)
+        self._bloom = bloom
+
+    def prune(self) -> int:
+        """
+        Deletes the revocations of expired tokens, run every REVOCATION_PURGE_INTERVAL seconds(see app.py)
+        :return: the number of rows deleted
+        """
+        return RevokedTokenModel.delete_expired()
@@ -0,0 +1,107 @@
+from typing import Any, Callable, Dict
+from marshmallow import fields, missing
+from marshmallow.decorators import PRE_DUMP, POST_DUMP
+
+"""
+libs.schema_compiler
+
+Schema.dump() walks every field object of the schema for every row it serializes(get_value, serialize, _serialize...)
+which adds up quickly on the list endpoints. compile_schema() takes one of our schema instances from schemas/ and
+generates a plain python function that reads the attributes straight into a dict, e.g for ItemSchema:
+
+    def dump(obj):
+        v0 = obj.id
+        v1 = obj.name
+        ...
+        out = {}
+        out["id"] = None if v0 is None else _convert0(v0)
+        out["name"] = None if v1 is None else _convert1(v1)
+        ...
+        return out
+
+Only fields whose marshmallow output we can reproduce exactly(Integer, Float, String) are inlined, anything else
+(relationships, dates, custom fields) is still serialized by its own marshmallow field so the output stays identical.
+dump_only/load_only/include_fk are honoured for free because we compile from schema.dump_fields, which marshmallow
+has already built from the schema's Meta options.
+"""
+
+# exact types only, a subclass may override _serialize
+_INLINE_CONVERTERS = {fields.Integer: int, fields.Float: float, fields.String: str}
+
+
+def _has_dump_hooks(schema) -> bool:
+    return schema._has_processors(PRE_DUMP) or schema._has_processors(POST_DUMP)
+
+
+def _compile_dump(schema) -> Callable[[Any], Dict]:
+    if _has_dump_hooks(schema):
+        # pre/post dump hooks can change anything, let marshmallow handle the schema
+        return lambda obj: schema.dump(obj, many=False)
+
+    namespace = {"_missing": missing, "_accessor": schema.get_attribute}
+    reads = ["def dump(obj):"]
+    writes = ["    out = {}"]
+    for index, (name, field) in enumerate(schema.dump_fields.items()):
+        key = repr(field.data_key if field.data_key is not None else name)
+        attribute = field.attribute or name
+        value = f"v{index}"
+        converter = _INLINE_CONVERTERS.get(type(field))
+
+        if not attribute.isidentifier():
+            converter = None
+        elif isinstance(field, fields.Nested) and not _has_dump_hooks(field.schema):
+            namespace[f"_nested{index}"] = _compile_dump(field.schema)
+            if field.many or field.schema.many:
+                expression = f"[_nested{index}(each) for each in {value}]"
+            else:
+                expression = f"_nested{index}({value})"
+            reads.append(f"    {value} = obj.{attribute}")
+            writes.append(f"    out[{key}] = None if {value} is None else {expression}")
+            continue
+
+        if converter is not None and not getattr(field, "as_string", False):
+            namespace[f"_convert{index}"] = converter
+            reads.append(f"    {value} = obj.{attribute}")
+            writes.append(
+                f"    out[{key}] = None if {value} is None else _convert{index}({value})"
+            )
+            continue
+
+        # fall back to the marshmallow field itself, a field that serializes to `missing` is left out like
+        # marshmallow does
+        namespace[f"_field{index}"] = field
+        reads.append(
+            f"    {value} = _field{index}.serialize({name!r}, obj, accessor=_accessor)"
+        )
+        writes.append(f"    if {value} is not _missing:")
+        writes.append(f"        out[{key}] = {value}")
+
+    # writes keep the field order of marshmallow's output
+    lines = reads + writes + ["    return out"]
+    exec("\n".join(lines), namespace)
+    return namespace["dump"]
+
+
+class CompiledSchema:
+    """
+    Wraps a schema instance, dump() goes through the compiled function, everything else(load, validate...) is
+    delegated to the original schema so a compiled schema can be used wherever the schema was used
+    """
+
+    def __init__(self, schema):
+        self.schema = schema
+        self._dump_one = _compile_dump(schema)
+
+    def dump(self, obj, *, many: bool = None):
+        many = self.schema.many if many is None else many
+        if many:
+            dump_one = self._dump_one
+            return [dump_one(each) for each in obj]
+        return self._dump_one(obj)
+
+    def __getattr__(self, name: str):
+        return getattr(self.schema, name)
+
+
+def compile_schema(schema) -> CompiledSchema:
+    return CompiledSchema(schema)
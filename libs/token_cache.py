@@ -0,0 +1,117 @@
+from collections import OrderedDict
+from threading import Lock
+from time import time
+from typing import Dict, Tuple, Union
+
+from flask_jwt_extended import utils as jwt_utils, view_decorators
+
+"""
+libs.token_cache
+
+Every @jwt_required/@fresh_jwt_required/@jwt_optional request decodes the JWT again, base64 and json for the header
+and claims plus the HMAC of the signature, although a client sends the same token on every request until it expires.
+TokenCache remembers the verified claims and headers of the last `max_size` tokens, keyed by the raw token, so a repeat
+token skips the signature check. A raw token can only map to the claims it was verified with, forging one means
+changing the token and that is a cache miss.
+
+An entry is only used until the token's exp claim, after that the token goes through the normal decode again which
+rejects it as expired. Revocation is still checked on every request, flask_jwt_extended calls our
+token_in_blacklist_loader after decoding whether the claims came from the cache or not.
+"""
+
+
+class TokenCache:
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # token -> (exp, claims, headers)
+        self._lock = Lock()
+
+    def _lookup(self, encoded_token: str) -> Union[Tuple[float, Dict, Dict], None]:
+        """
+        The (exp, claims, headers) a token was verified with, None when it was not verified yet or its entry expired
+        """
+        with self._lock:
+            entry = self._entries.get(encoded_token)
+            if entry is None:
+                return None
+            if entry[0] <= time():
+                del self._entries[encoded_token]
+                return None
+            self._entries.move_to_end(encoded_token)
+            return entry
+
+    def decode_token(
+        self, encoded_token: str, csrf_value: str = None, allow_expired: bool = False
+    ) -> Dict:
+        """
+        Same as flask_jwt_extended.utils.decode_token, only verifies tokens it has not seen yet.
+        Tokens sent with a CSRF value(cookies) are always decoded, the value has to be checked against the claims
+        """
+        if self.max_size <= 0 or allow_expired or csrf_value is not None:
+            return jwt_utils.decode_token(encoded_token, csrf_value, allow_expired)
+
+        entry = self._lookup(encoded_token)
+        if entry is not None:
+            self.hits += 1
+            return dict(entry[1])  # a copy, the cached claims outlive the request
+
+        self.misses += 1
+        claims = jwt_utils.decode_token(encoded_token)
+        headers = jwt_utils.get_unverified_jwt_headers(encoded_token)
+        with self._lock:
+            self._entries[encoded_token] = (
+                claims.get("exp", float("inf")),
+                dict(claims),
+                headers,
+            )
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return claims
+
+    def get_unverified_jwt_headers(self, encoded_token: str) -> Dict:
+        """
+        Same as flask_jwt_extended.utils.get_unverified_jwt_headers, the headers of a cached token come from its entry
+        """
+        entry = self._lookup(encoded_token) if self.max_size > 0 else None
+        if entry is not None:
+            return dict(entry[2])
+        return jwt_utils.get_unverified_jwt_headers(encoded_token)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+        }
+
+
+token_cache = TokenCache()
+
+
+def configure_token_cache(config) -> None:
+    """
+    Called from app.py once the config has been loaded, JWT_DECODE_CACHE_SIZE=0 disables the cache.
+    flask_jwt_extended 3.x has no hook for decoding, so the two functions its view decorators import from
+    flask_jwt_extended.utils are replaced by the cache's. Each one answers exactly like the function it replaces
+    whatever order they are called in. A version of the library that no longer uses them is left alone and runs
+    uncached instead of being patched blindly.
+    """
+    token_cache.max_size = config.get("JWT_DECODE_CACHE_SIZE", token_cache.max_size)
+    token_cache.clear()
+    for name in ("decode_token", "get_unverified_jwt_headers"):
+        if getattr(view_decorators, name, None) not in (
+            getattr(jwt_utils, name),
+            getattr(token_cache, name),
+        ):
+            return
+    view_decorators.decode_token = token_cache.decode_token
+    view_decorators.get_unverified_jwt_headers = token_cache.get_unverified_jwt_headers
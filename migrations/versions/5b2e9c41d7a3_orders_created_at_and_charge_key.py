@@ -0,0 +1,77 @@
+"""orders.created_at, orders.charge_key and the indexes added to the existing tables
+
+db.create_all() creates the new tables(charge_jobs, email_outbox, revenue rollups...) but never alters a table that
+already exists, this brings a database created before them up to date. Every step is skipped when the database already
+has it, so a database created by db.create_all() from the current models can be upgraded(or stamped) as well.
+
+Revision ID: 5b2e9c41d7a3
+Revises:
+Create Date: 2026-10-18 12:40:00.000000
+
+"""
+from time import time
+from uuid import uuid4
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "5b2e9c41d7a3"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ("orders", "ix_orders_status_id", ["status", "id"]),
+    ("items_in_order", "ix_items_in_order_order_id", ["order_id"]),
+    ("confirmations", "ix_confirmations_user_id_expire_at", ["user_id", "expire_at"]),
+    ("confirmations", "ix_confirmations_confirmed_expire_at", ["confirmed", "expire_at"]),
+]
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    columns = {column["name"] for column in inspector.get_columns("orders")}
+    orders = sa.table(
+        "orders",
+        sa.column("id", sa.Integer),
+        sa.column("created_at", sa.Integer),
+        sa.column("charge_key", sa.String),
+    )
+
+    if "created_at" not in columns:
+        op.add_column(
+            "orders",
+            sa.Column("created_at", sa.Integer(), nullable=False, server_default="0"),
+        )
+        # the existing orders are dated now, so the recovery sweep does not take them all for stale at once
+        op.execute(
+            orders.update().where(orders.c.created_at == 0).values(created_at=int(time()))
+        )
+
+    if "charge_key" not in columns:
+        op.add_column("orders", sa.Column("charge_key", sa.String(length=32), nullable=True))
+        connection = op.get_bind()
+        for (_id,) in connection.execute(sa.select([orders.c.id])).fetchall():
+            connection.execute(
+                orders.update().where(orders.c.id == _id).values(charge_key=uuid4().hex)
+            )
+        with op.batch_alter_table("orders") as batch_op:
+            batch_op.alter_column(
+                "charge_key", existing_type=sa.String(length=32), nullable=False
+            )
+        op.create_index("ix_orders_charge_key", "orders", ["charge_key"], unique=True)
+
+    for table, name, index_columns in INDEXES:
+        if name not in {index["name"] for index in inspector.get_indexes(table)}:
+            op.create_index(name, table, index_columns)
+
+
+def downgrade():
+    for table, name, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
+    op.drop_index("ix_orders_charge_key", table_name="orders")
+    with op.batch_alter_table("orders") as batch_op:
+        batch_op.drop_column("charge_key")
+        batch_op.drop_column("created_at")
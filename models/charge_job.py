@@ -0,0 +1,58 @@
+from time import time
+from typing import Union
+
+from sqlalchemy.orm.attributes import set_committed_value
+
+from db import db
+
+QUEUED = "queued"
+RUNNING = "running"
+
+
+class ChargeJobModel(db.Model):
+    """
+    A Stripe charge waiting to be made by the charge workers(see libs/charge_queue.py).
+    The job is written in the same commit as its order and deleted once the order is complete or failed, so the table
+    only holds the charges that are still to be made.
+    The card token is only kept while the job is queued, it is cleared from the row as soon as a worker claims it.
+    """
+
+    __tablename__ = "charge_jobs"
+
+    id = db.Column(db.Integer, primary_key=True)
+    order_id = db.Column(db.Integer, db.ForeignKey("orders.id"), nullable=False)
+    token = db.Column(db.String(255), nullable=True)
+    status = db.Column(db.String(20), nullable=False, default=QUEUED, index=True)
+    created_at = db.Column(db.Integer, nullable=False, default=lambda: int(time()))
+    claimed_at = db.Column(db.Integer, nullable=True)
+
+    order = db.relationship("OrderModel")
+
+    @classmethod
+    def claim_next(cls) -> Union["ChargeJobModel", None]:
+        """
+        Takes the oldest queued job for the calling worker. The claim is a conditional UPDATE, so when two workers pick
+        the same job only one of them gets a row count of 1, the other one tries the next job.
+        """
+        while True:
+            job = cls.query.filter_by(status=QUEUED).order_by(cls.id).first()
+            if job is None:
+                return None
+            token = job.token
+            claimed = cls.query.filter_by(id=job.id, status=QUEUED).update(
+                {cls.status: RUNNING, cls.claimed_at: int(time()), cls.token: None},
+                synchronize_session=False,
+            )
+            db.session.commit()
+            if claimed:
+                # only the claiming worker still has the token, in memory
+                set_committed_value(job, "token", token)
+                return job
+
+    def save_to_db(self) -> None:
+        db.session.add(self)
+        db.session.commit()
+
+    def delete_from_db(self) -> None:
+        db.session.delete(self)
+        db.session.commit()
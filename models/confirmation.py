@@ -4,10 +4,18 @@ from uuid import uuid4
 from db import db
 
 CONFIRMATION_EXPIRATION_DELTA = 1800  # 30 minutes
+# expired links are kept a day longer, so they are still answered with "link expired" and not "not found"
+CONFIRMATION_PURGE_DELAY = 86400
 
 
 class ConfirmationModel(db.Model):
     __tablename__ = "confirmations"
+    __table_args__ = (
+        # most_recent_confirmation(and the login query) read the latest confirmation of one user
+        db.Index("ix_confirmations_user_id_expire_at", "user_id", "expire_at"),
+        # purge_expired() walks the expired, unconfirmed rows
+        db.Index("ix_confirmations_confirmed_expire_at", "confirmed", "expire_at"),
+    )
 
     id = db.Column(db.String(50), primary_key=True)
     expire_at = db.Column(db.Integer, nullable=False)
@@ -43,6 +51,46 @@ class ConfirmationModel(db.Model):
             self.expire_at = int(time())
             self.save_to_db()
 
+    @classmethod
+    def purge_expired(
+        cls, older_than: int = CONFIRMATION_PURGE_DELAY, batch_size: int = 1000
+    ) -> int:
+        """
+        Deletes the unconfirmed confirmations that expired more than `older_than` seconds ago, which includes every
+        link replaced by a resend(see force_to_expire). Confirmed rows are kept, they record that the user confirmed.
+        So is the latest confirmation of each user, a user who never confirmed still has a most_recent_confirmation
+        to resend from(see ConfirmationByUser) and their old link is still answered with "link expired".
+        Rows are deleted `batch_size` at a time with a commit after each batch, so no lock is held for long.
+        :return: the number of rows deleted
+        """
+        cutoff = int(time()) - older_than
+        newer = db.aliased(cls)
+        replaced = (
+            db.session.query(newer.id)
+            .filter(
+                newer.user_id == cls.user_id,
+                db.or_(
+                    newer.expire_at > cls.expire_at,
+                    db.and_(newer.expire_at == cls.expire_at, newer.id > cls.id),
+                ),
+            )
+            .exists()
+        )
+        deleted = 0
+        while True:
+            ids = [
+                _id
+                for _id, in db.session.query(cls.id)
+                .filter(cls.confirmed == False, cls.expire_at < cutoff, replaced)
+                .limit(batch_size)
+            ]
+            if not ids:
+                return deleted
+            deleted += cls.query.filter(cls.id.in_(ids)).delete(
+                synchronize_session=False
+            )
+            db.session.commit()
+
     def save_to_db(self) -> None:
         db.session.add(self)
         db.session.commit()
@@ -0,0 +1,165 @@
+import json
+from hashlib import sha256
+from time import time
+from typing import Dict, Tuple, Union
+from uuid import uuid4
+
+from sqlalchemy.exc import IntegrityError
+
+from db import db
+
+IDEMPOTENCY_KEY_EXPIRATION_DELTA = 86400  # 24 hours
+# a request still in progress after this long is taken to be dead(crashed worker), a retry can then take its key over.
+# Longer than a checkout can take, STRIPE_CONNECT_TIMEOUT + STRIPE_READ_TIMEOUT
+IDEMPOTENCY_LEASE_DELTA = 120  # 2 minutes
+
+
+class IdempotentResponseModel(db.Model):
+    """
+    The first response given to a request sent with an `Idempotency-Key` header, so that a retry of that request
+    gets the same response back instead of being processed(and charged) a second time.
+    Keys are scoped to their owner(the caller, see Order.post), and the fingerprint of the request body is kept with
+    the key so that reusing a key for a different request is refused instead of replaying the wrong response.
+    A row without a status_code is a request that is still being processed, by the worker holding `claimed_by`
+    until `lease_expire_at`.
+    """
+
+    __tablename__ = "idempotent_responses"
+
+    owner = db.Column(db.String(80), primary_key=True)
+    key = db.Column(db.String(255), primary_key=True)
+    fingerprint = db.Column(db.String(64), nullable=False)
+    status_code = db.Column(db.Integer, nullable=True)
+    body = db.Column(db.Text, nullable=True)
+    claimed_by = db.Column(db.String(32), nullable=True)
+    lease_expire_at = db.Column(db.Integer, nullable=True)
+    expire_at = db.Column(db.Integer, nullable=False, index=True)
+
+    def __init__(self, owner: str, key: str, fingerprint: str, **kwargs):
+        super().__init__(**kwargs)
+        self.owner = owner
+        self.key = key
+        self.fingerprint = fingerprint
+        self.claimed_by = uuid4().hex
+        self.lease_expire_at = int(time()) + IDEMPOTENCY_LEASE_DELTA
+        self.expire_at = int(time()) + IDEMPOTENCY_KEY_EXPIRATION_DELTA
+
+    @staticmethod
+    def fingerprint_of(owner: str, body: bytes) -> str:
+        """
+        Hash of the caller and the request body. JSON bodies are hashed in a canonical form, so a retry that only
+        orders its keys differently is still the same request
+        """
+        try:
+            body = json.dumps(json.loads(body), sort_keys=True).encode()
+        except ValueError:
+            pass  # not JSON, the raw bytes are hashed
+        return sha256(owner.encode() + b"\0" + body).hexdigest()
+
+    @property
+    def expired(self) -> bool:
+        return time() > self.expire_at
+
+    @property
+    def completed(self) -> bool:
+        return self.status_code is not None
+
+    @property
+    def lease_expired(self) -> bool:
+        return not self.completed and time() > self.lease_expire_at
+
+    @property
+    def response(self) -> Tuple[Dict, int]:
+        return json.loads(self.body), self.status_code
+
+    @classmethod
+    def find_by_key(cls, owner: str, key: str) -> "IdempotentResponseModel":
+        record = cls.query.filter_by(owner=owner, key=key).first()
+        if record and record.expired:
+            record.delete_from_db()
+            return None
+        return record
+
+    @classmethod
+    def reserve(
+        cls, owner: str, key: str, fingerprint: str
+    ) -> Union["IdempotentResponseModel", None]:
+        """
+        Inserts an in progress row for the key, the primary key makes sure only one of two concurrent requests with the
+        same key gets it
+        :return: the reserved row, or None if another request holds the key already
+        """
+        record = cls(owner, key, fingerprint)
+        db.session.add(record)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return None
+        return record
+
+    def take_over(self) -> Union["IdempotentResponseModel", None]:
+        """
+        Claims the key of a request whose lease expired, with a conditional UPDATE so that only one of several
+        concurrent retries gets it
+        :return: the row now held by the caller, or None if another retry took it first
+        """
+        cls = type(self)
+        claimed_by = uuid4().hex
+        taken = cls.query.filter(
+            cls.owner == self.owner,
+            cls.key == self.key,
+            cls.status_code.is_(None),
+            cls.claimed_by == self.claimed_by,
+            cls.lease_expire_at < int(time()),
+        ).update(
+            {
+                cls.claimed_by: claimed_by,
+                cls.lease_expire_at: int(time()) + IDEMPOTENCY_LEASE_DELTA,
+            },
+            synchronize_session=False,
+        )
+        db.session.commit()
+        if not taken:
+            return None
+        db.session.refresh(self)
+        return self
+
+    def complete(self, body: Dict, status_code: int) -> None:
+        """
+        Stores the response, unless the lease was lost to a retry in the meantime, that retry's response is kept then
+        """
+        cls = type(self)
+        cls.query.filter_by(
+            owner=self.owner, key=self.key, claimed_by=self.claimed_by
+        ).update(
+            {cls.body: json.dumps(body), cls.status_code: status_code},
+            synchronize_session=False,
+        )
+        db.session.commit()
+
+    def release(self) -> None:
+        """
+        Gives the key up without storing a response, so the request can be retried with it
+        """
+        db.session.rollback()  # the failed request may have left the session unusable
+        type(self).query.filter_by(
+            owner=self.owner, key=self.key, claimed_by=self.claimed_by
+        ).delete(synchronize_session=False)
+        db.session.commit()
+
+    @classmethod
+    def purge_expired(cls) -> int:
+        deleted = cls.query.filter(cls.expire_at < int(time())).delete(
+            synchronize_session=False
+        )
+        db.session.commit()
+        return deleted
+
+    def save_to_db(self) -> None:
+        db.session.add(self)
+        db.session.commit()
+
+    def delete_from_db(self) -> None:
+        db.session.delete(self)
+        db.session.commit()
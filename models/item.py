@@ -1,5 +1,7 @@
-from typing import Dict, List, Union
+from typing import Dict, List, Tuple, Union
 from db import db
+from libs.cache import finder_cache
+from libs.pagination import keyset_page
 
 # adding custom json types
 # the code below means all keys in the Dict are strings and it's values a union of int, str and float
@@ -45,6 +47,7 @@ class ItemModel(db.Model):
     """
 
     @classmethod
+    @finder_cache.finder("name")
     def find_by_name(
         cls, name: str
     ) -> "ItemModel":  # returning the current class as a type
@@ -52,20 +55,51 @@ class ItemModel(db.Model):
         return cls.query.filter_by(name=name).first()
 
     @classmethod
+    @finder_cache.finder("id")
     def find_by_id(
         cls, _id: int
     ) -> "ItemModel":  # returning the current class as a type
         return cls.query.filter_by(id=_id).first()
 
+    @classmethod
+    def find_by_ids(cls, ids: List[int]) -> Dict[int, "ItemModel"]:
+        """
+        Loads many items with a single `WHERE id IN (...)` query
+        :return: the found items keyed by id, ids that do not exist are simply not in the dictionary
+        """
+        if not ids:
+            return {}
+        return {item.id: item for item in cls.query.filter(cls.id.in_(set(ids)))}
+
     @classmethod
     def find_all(cls) -> List["ItemModel"]:  # returning the current class as a type
         # def find_all(cls) -> List
         return cls.query.all()
 
+    @classmethod
+    def find_page(
+        cls, limit: int, after: int = None
+    ) -> Tuple[List["ItemModel"], Union[int, None]]:
+        # keyset pagination on the primary key, see libs/pagination.py
+        return keyset_page(cls.query, cls.id, limit, after)
+
+    # column-only queries(SELECT name FROM items) for callers that only need the names, no ORM objects are built
+    @classmethod
+    def find_all_names(cls) -> List[str]:
+        return [name for (name,) in db.session.query(cls.name)]
+
+    @classmethod
+    def find_names_page(
+        cls, limit: int, after: int = None
+    ) -> Tuple[List[str], Union[int, None]]:
+        rows, next_cursor = keyset_page(
+            db.session.query(cls.id, cls.name), cls.id, limit, after
+        )
+        return [row.name for row in rows], next_cursor
+
+    # both go through the finder cache so that cached lookups of this row are invalidated
     def save_to_db(self) -> None:
-        db.session.add(self)
-        db.session.commit()
+        finder_cache.save(self)
 
     def delete_from_db(self) -> None:
-        db.session.delete(self)
-        db.session.commit()
+        finder_cache.delete(self)
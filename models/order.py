@@ -1,11 +1,36 @@
-import os
 import stripe
+from time import time
+from uuid import uuid4
+from sqlalchemy import inspect, or_
+from sqlalchemy.orm import selectinload
+from sqlalchemy.orm.attributes import set_committed_value
 
 from db import db
-from typing import List
+from libs import payments
+from libs.pagination import keyset_page
+from libs.strings import gettext
+from models.charge_job import ChargeJobModel, QUEUED
+from models.item import ItemModel
+from models.revenue import record_order_revenue
+from typing import List, Tuple, Union
 
 CURRENCY = "usd"
 
+# order statuses and the moves allowed between them, an order is pending while we are talking to Stripe
+PENDING = "pending"
+COMPLETE = "complete"
+FAILED = "failed"
+ORDER_TRANSITIONS = {PENDING: {COMPLETE, FAILED}, COMPLETE: set(), FAILED: set()}
+
+# an order still pending after this long was left behind by a worker that died while charging it
+IN_FLIGHT_TIMEOUT = 600  # 10 minutes
+
+
+class OrderStatusException(Exception):
+    def __init__(self, message: str):
+        super().__init__(message)
+
+
 # # this can not help us add a quantity of items to our relationship like [1, 1] or [2, 2] etc
 # items_to_orders = db.Table(
 #     "items_to_orders",
@@ -24,7 +49,7 @@ class ItemsInOrder(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     item_id = db.Column(db.Integer, db.ForeignKey("items.id"))
-    order_id = db.Column(db.Integer, db.ForeignKey("orders.id"))
+    order_id = db.Column(db.Integer, db.ForeignKey("orders.id"), index=True)
     # quantity is the number of items in an order
     quantity = db.Column(db.Integer)
 
@@ -35,8 +60,20 @@ class ItemsInOrder(db.Model):
 class OrderModel(db.Model):
     __tablename__ = "orders"
 
+    __table_args__ = (
+        # serves `WHERE status = :status AND id < :after ORDER BY id DESC` as one index range scan
+        db.Index("ix_orders_status_id", "status", "id"),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     status = db.Column(db.String(20), nullable=False)
+    # the orders that existed before this column was added are dated by the migration that adds it(see migrations/)
+    created_at = db.Column(
+        db.Integer, nullable=False, default=lambda: int(time()), server_default="0"
+    )
+    # the order's Stripe idempotency key and charge metadata, unlike the id it is unique across databases(a restored
+    # backup, staging and production sharing a Stripe account...) so Stripe never mistakes two orders for one
+    charge_key = db.Column(db.String(32), nullable=False, unique=True, index=True)
 
     """
     we are doing this to make the order linked to a bunch of itens but the items will not know that they are linked 
@@ -50,14 +87,51 @@ class OrderModel(db.Model):
     # backref is an advance of back_populated, it will be reference only once if used
     items = db.relationship("ItemsInOrder", back_populates="order")
 
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        if self.charge_key is None:
+            self.charge_key = uuid4().hex
+
+    @property
+    def lines(self) -> List[Tuple[int, str, int, int]]:
+        """
+        (item id, item name, quantity, unit price in cents) for every item of this order, in the order they were added.
+        They are loaded with one query joining items_in_order and items, instead of lazily loading every line's item
+        one query at a time, and memoized on the order since an order's items do not change once it is created
+        """
+        lines = self.__dict__.get("_lines")
+        if lines is None:
+            identity = inspect(self).identity  # unlike self.id, this does not reload an expired order
+            if identity is None:
+                # not saved yet, everything is still in memory
+                rows = [
+                    (each.item.id, each.item.name, each.quantity, each.item.price)
+                    for each in self.items
+                ]
+            else:
+                rows = (
+                    db.session.query(
+                        ItemModel.id, ItemModel.name, ItemsInOrder.quantity, ItemModel.price
+                    )
+                    .join(ItemsInOrder.item)
+                    .filter(ItemsInOrder.order_id == identity[0])
+                    .order_by(ItemsInOrder.id)
+                    .all()
+                )
+            # price is a float in dollars, charge in whole cents so rounding errors can not add up over many lines
+            lines = [
+                (item_id, name, quantity, round(price * 100))
+                for item_id, name, quantity, price in rows
+            ]
+            self._lines = lines
+        return lines
+
     @property
     def description(self) -> str:
         """
         Generates a simple string representing this order, in the format of "5x chair, 2x table"
         """
-        item_counts = [
-            f"{item_data.quantity}x {item_data.item.name}" for item_data in self.items
-        ]
+        item_counts = [f"{quantity}x {name}" for _, name, quantity, _ in self.lines]
         return ",".join(item_counts)
 
     @property
@@ -67,39 +141,136 @@ class OrderModel(db.Model):
         Assumes item price is in USD–multi-currency becomes much tricker!
         :return int: total amount of cents to be charged in this order.x`
         """
-        return int(
-            sum([item_data.item.price * item_data.quantity for item_data in self.items])
-            * 100
-        )
+        return sum(quantity * cents for _, _, quantity, cents in self.lines)
 
     @classmethod
-    def find_all(cls) -> List["OrderModel"]:
-        return cls.query.all()
+    def find_all(cls, status: str = None) -> List["OrderModel"]:
+        query = cls.query.options(selectinload(cls.items))
+        if status is not None:
+            query = query.filter_by(status=status)
+        return query.all()
+
+    @classmethod
+    def find_page(
+        cls, limit: int, after: int = None, status: str = None
+    ) -> Tuple[List["OrderModel"], Union[int, None]]:
+        """
+        Newest orders first, ids are handed out in creation order so paging down the id is paging back in time.
+        The lines of every order on the page are loaded with one extra query(selectinload) instead of one per order
+        """
+        query = cls.query.options(selectinload(cls.items))
+        if status is not None:
+            query = query.filter_by(status=status)
+        return keyset_page(query, cls.id, limit, after, descending=True)
 
     @classmethod
     def find_by_id(cls, _id: int) -> "OrderModel":
         return cls.query.filter_by(id=_id).first()
 
     def charge_with_stripe(self, token: str) -> stripe.Charge:
-        # Set your secret key: remember to change this to your live secret key in production
-
-        # See your keys here: https://dashboard.stripe.com/account/apikeys
-        stripe.api_key = os.getenv("STRIPE_API_KEY")
-
-        return stripe.Charge.create(
+        return payments.payment_client.create_charge(
             amount=self.amount,  # amount in us dollar cent/nigerian kobo we want to charge
             currency=CURRENCY,
             description=self.description,
             source=token,
+            order_id=self.id,
+            order_key=self.charge_key,  # lets fail_stale_pending find the charge again
         )
 
-    def set_status(self, new_status: str) -> None:
+    def set_status(self, new_status: str, commit: bool = True) -> None:
         """
-        Sets the new status for the order and saves to the database—so that an order is never not committed to disk.
+        Moves the order to a new status, only the moves in ORDER_TRANSITIONS are allowed.
+        A saved order is moved with a conditional UPDATE on the status it was read with, so an order that was
+        finished in the meantime by someone else(e.g the crash recovery sweep) is not overwritten from a stale copy.
         :param new_status: the new status for this order to be saved.
+        :param commit: pass False to batch the change with other writes into the caller's commit.
+        """
+        if new_status not in ORDER_TRANSITIONS.get(self.status, ()):
+            raise OrderStatusException(
+                gettext("order_invalid_transition").format(self.status, new_status)
+            )
+        identity = inspect(self).identity
+        if identity is None:
+            self.status = new_status
+        else:
+            cls = type(self)
+            moved = cls.query.filter(
+                cls.id == identity[0], cls.status == self.status
+            ).update({cls.status: new_status}, synchronize_session=False)
+            if not moved:
+                db.session.rollback()
+                raise OrderStatusException(
+                    gettext("order_invalid_transition").format(self.status, new_status)
+                )
+            set_committed_value(self, "status", new_status)
+        if new_status in (COMPLETE, FAILED):
+            # same transaction as the status change, so the rollups can not drift from the orders
+            record_order_revenue(new_status, self.lines)
+        if commit:
+            self.save_to_db()
+
+    def checkout(self, token: str) -> stripe.Charge:
+        """
+        Charges a pending order and records the outcome, the order must already be committed as pending so that a
+        crash while talking to Stripe leaves a trace(see fail_stale_pending).
+        That is two commits per checkout, pending before the charge and complete/failed after it.
+        Stripe errors are re-raised once the order is marked as failed.
+        """
+        try:
+            charge = self.charge_with_stripe(token)
+        except Exception:
+            try:
+                self.set_status(FAILED)
+            except OrderStatusException:
+                pass  # already failed by the crash recovery sweep
+            raise
+        self.set_status(COMPLETE)
+        return charge
+
+    @classmethod
+    def fail_stale_pending(cls, older_than: int = IN_FLIGHT_TIMEOUT) -> int:
         """
-        self.status = new_status
-        self.save_to_db()
+        Crash recovery, settles the orders that stayed pending for too long.
+        The worker charging them may have died after Stripe made the charge, so Stripe is asked first(see
+        payments.find_charge), a paid order is completed and an unpaid one failed. Orders Stripe could not be asked
+        about stay pending until the next sweep.
+        Run every ORDER_RECOVERY_INTERVAL seconds(see app.py) and by `flask recover-orders`, never in a request.
+        Orders with a charge job are left alone while the job is queued or was claimed less than `older_than` seconds
+        ago, however long they waited in the queue. The jobs claimed before that were being charged by a worker that
+        crashed, they are dropped and their orders settled.
+        :return: the number of orders recovered.
+        """
+        cutoff = int(time()) - older_than
+        in_flight = db.session.query(ChargeJobModel.order_id).filter(
+            or_(ChargeJobModel.status == QUEUED, ChargeJobModel.claimed_at >= cutoff)
+        )
+        stale = cls.query.filter(
+            cls.status == PENDING,
+            cls.created_at < cutoff,
+            ~cls.id.in_(in_flight),
+        ).all()
+
+        recovered = 0
+        for order in stale:
+            try:
+                charge = payments.payment_client.find_charge(order.charge_key)
+            except stripe.error.StripeError:
+                continue
+            if charge is not None and charge.get("status") == "pending":
+                continue  # Stripe has not decided yet
+            try:
+                order.set_status(
+                    COMPLETE if charge is not None and charge.get("paid") else FAILED
+                )
+            except OrderStatusException:
+                continue  # settled by its worker in the meantime
+            recovered += 1
+
+        ChargeJobModel.query.filter(
+            ChargeJobModel.status != QUEUED, ChargeJobModel.claimed_at < cutoff,
+        ).delete(synchronize_session=False)
+        db.session.commit()
+        return recovered
 
     def save_to_db(self) -> None:
         db.session.add(self)
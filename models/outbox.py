@@ -0,0 +1,154 @@
+import json
+from time import time
+from typing import Dict, List
+from uuid import uuid4
+
+from db import db
+
+QUEUED = "queued"
+SENDING = "sending"
+FAILED = "failed"
+
+
+class OutboxEmailModel(db.Model):
+    """
+    An email waiting to be sent by the mail dispatcher(see libs/mail_outbox.py).
+    It is written in the same transaction as whatever it is about(e.g the user and their confirmation), so an email is
+    queued if and only if that transaction commits. Sent emails are deleted, the ones that failed for good are kept
+    with their last error.
+    subject/text/html are Mailgun templates, %recipient.<name>% is replaced by `variables[name]` for each recipient,
+    which lets the dispatcher send the emails sharing a template to many recipients in one request.
+    """
+
+    __tablename__ = "email_outbox"
+    __table_args__ = (db.Index("ix_email_outbox_status_next_attempt_at", "status", "next_attempt_at"),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    recipient = db.Column(db.String(80), nullable=False)
+    subject = db.Column(db.String(255), nullable=False)
+    text = db.Column(db.Text, nullable=False)
+    html = db.Column(db.Text, nullable=False)
+    variables = db.Column(db.Text, nullable=False, default="{}")  # json
+    status = db.Column(db.String(20), nullable=False, default=QUEUED)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.Integer, nullable=False, default=lambda: int(time()))
+    created_at = db.Column(db.Integer, nullable=False, default=lambda: int(time()))
+    claimed_by = db.Column(db.String(32), nullable=True, index=True)
+    claimed_at = db.Column(db.Integer, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+
+    @classmethod
+    def queue(
+        cls,
+        recipient: str,
+        subject: str,
+        text: str,
+        html: str,
+        variables: Dict[str, str] = None,
+        commit: bool = True,
+    ) -> "OutboxEmailModel":
+        """
+        :param commit: False leaves the commit to the caller, so the email is part of the caller's transaction
+        """
+        email = cls(
+            recipient=recipient,
+            subject=subject,
+            text=text,
+            html=html,
+            variables=json.dumps(variables or {}),
+        )
+        db.session.add(email)
+        if commit:
+            db.session.commit()
+        return email
+
+    @property
+    def recipient_variables(self) -> Dict[str, str]:
+        return json.loads(self.variables)
+
+    @classmethod
+    def claim_batch(
+        cls, batch_size: int, stale_after: int, max_attempts: int
+    ) -> List["OutboxEmailModel"]:
+        """
+        Takes up to `batch_size` due emails sharing the template of the oldest due one.
+        The claim is a conditional UPDATE that tags the rows with a token of our own, so several dispatchers can share
+        the table, each one only gets back the rows its UPDATE actually changed.
+        Emails claimed more than `stale_after` seconds ago belong to a dispatcher that died(or crashed on them), they
+        are queued again and that counts as an attempt, so a batch that keeps crashing is failed after `max_attempts`.
+        A batch never holds two emails to the same recipient, recipient variables are keyed by address so the second
+        one would be lost, it is left queued for a later batch instead.
+        """
+        now = int(time())
+        cls.query.filter(cls.status == SENDING, cls.claimed_at < now - stale_after).update(
+            {
+                cls.status: db.case(
+                    [(cls.attempts + 1 >= max_attempts, FAILED)], else_=QUEUED
+                ),
+                cls.attempts: cls.attempts + 1,
+                cls.claimed_by: None,
+                cls.last_error: "claim expired, the dispatcher died while sending",
+            },
+            synchronize_session=False,
+        )
+        due = cls.query.filter(cls.status == QUEUED, cls.next_attempt_at <= now)
+        first = due.order_by(cls.id).first()
+        if first is None:
+            db.session.commit()
+            return []
+
+        ids = {}
+        for _id, recipient in (
+            due.with_entities(cls.id, cls.recipient)
+            .filter_by(subject=first.subject, text=first.text, html=first.html)
+            .order_by(cls.id)
+            .limit(batch_size)
+        ):
+            ids.setdefault(recipient, _id)  # the oldest email to each recipient
+        ids = list(ids.values())
+        token = uuid4().hex
+        cls.query.filter(cls.id.in_(ids), cls.status == QUEUED).update(
+            {cls.status: SENDING, cls.claimed_by: token, cls.claimed_at: now},
+            synchronize_session=False,
+        )
+        db.session.commit()
+        return cls.query.filter_by(claimed_by=token).order_by(cls.id).all()
+
+    @classmethod
+    def delete_batch(cls, emails: List["OutboxEmailModel"]) -> None:
+        cls.query.filter(cls.id.in_([email.id for email in emails])).delete(
+            synchronize_session=False
+        )
+        db.session.commit()
+
+    @classmethod
+    def retry_batch(
+        cls, emails: List["OutboxEmailModel"], error: str, max_attempts: int, backoff: float
+    ) -> None:
+        """
+        Queues the emails again after an exponential backoff(backoff, 2 * backoff, 4 * backoff...), the ones that
+        already had `max_attempts` attempts are marked as failed
+        """
+        now = time()
+        for email in emails:
+            email.attempts += 1
+            email.last_error = error
+            email.claimed_by = None
+            if email.attempts >= max_attempts:
+                email.status = FAILED
+            else:
+                email.status = QUEUED
+                email.next_attempt_at = int(now + backoff * 2 ** (email.attempts - 1))
+        db.session.commit()
+
+    @classmethod
+    def fail_batch(cls, emails: List["OutboxEmailModel"], error: str) -> None:
+        """
+        For errors that retrying can not fix, e.g Mailgun rejecting the request as invalid
+        """
+        for email in emails:
+            email.attempts += 1
+            email.last_error = error
+            email.claimed_by = None
+            email.status = FAILED
+        db.session.commit()
@@ -0,0 +1,106 @@
+from collections import defaultdict
+from datetime import date, datetime
+from typing import Dict, List, Tuple
+
+from sqlalchemy.exc import IntegrityError
+
+from db import db
+
+"""
+Revenue rollups, kept up to date as orders reach a final status(see OrderModel.set_status) so that revenue reports
+read one row per day instead of scanning orders and items_in_order.
+"""
+
+
+class RevenueByDayModel(db.Model):
+    __tablename__ = "revenue_by_day"
+    __table_args__ = (db.UniqueConstraint("day", "status"),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False)
+    status = db.Column(db.String(20), nullable=False)
+    revenue = db.Column(db.BigInteger, nullable=False, default=0)  # cents
+    units = db.Column(db.Integer, nullable=False, default=0)
+    orders = db.Column(db.Integer, nullable=False, default=0)
+
+    @classmethod
+    def find_range(
+        cls, status: str, start: date, end: date
+    ) -> List["RevenueByDayModel"]:
+        return (
+            cls.query.filter(cls.status == status, cls.day.between(start, end))
+            .order_by(cls.day)
+            .all()
+        )
+
+
+class RevenueByItemDayModel(db.Model):
+    __tablename__ = "revenue_by_item_day"
+    __table_args__ = (db.UniqueConstraint("item_id", "day", "status"),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    item_id = db.Column(db.Integer, db.ForeignKey("items.id"), nullable=False)
+    day = db.Column(db.Date, nullable=False)
+    status = db.Column(db.String(20), nullable=False)
+    revenue = db.Column(db.BigInteger, nullable=False, default=0)  # cents
+    units = db.Column(db.Integer, nullable=False, default=0)
+
+    @classmethod
+    def find_range(
+        cls, item_id: int, status: str, start: date, end: date
+    ) -> List["RevenueByItemDayModel"]:
+        return (
+            cls.query.filter(
+                cls.item_id == item_id, cls.status == status, cls.day.between(start, end)
+            )
+            .order_by(cls.day)
+            .all()
+        )
+
+
+def _increment(model, key: Dict, **amounts: int) -> None:
+    """
+    Adds `amounts` to the rollup row identified by `key`, creating the row if needed.
+    The row is created inside a savepoint, if another transaction created it first the unique constraint rejects our
+    insert and we add to their row instead.
+    """
+    changes = {
+        getattr(model, column): getattr(model, column) + amount
+        for column, amount in amounts.items()
+    }
+    if model.query.filter_by(**key).update(changes, synchronize_session=False):
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.add(model(**key, **amounts))
+    except IntegrityError:
+        model.query.filter_by(**key).update(changes, synchronize_session=False)
+
+
+def record_order_revenue(
+    status: str, lines: List[Tuple[int, str, int, int]], day: date = None
+) -> None:
+    """
+    Adds an order to the rollups of its final status, the caller commits
+    :param lines: the order's (item id, item name, quantity, unit price in cents), see OrderModel.lines
+    """
+    day = day or datetime.utcnow().date()
+    by_item = defaultdict(lambda: [0, 0])
+    for item_id, _, quantity, cents in lines:
+        by_item[item_id][0] += quantity * cents
+        by_item[item_id][1] += quantity
+
+    _increment(
+        RevenueByDayModel,
+        {"day": day, "status": status},
+        revenue=sum(revenue for revenue, _ in by_item.values()),
+        units=sum(units for _, units in by_item.values()),
+        orders=1,
+    )
+    for item_id, (revenue, units) in by_item.items():
+        _increment(
+            RevenueByItemDayModel,
+            {"item_id": item_id, "day": day, "status": status},
+            revenue=revenue,
+            units=units,
+        )
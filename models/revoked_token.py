@@ -0,0 +1,51 @@
+from time import time
+from typing import List, Tuple
+
+from db import db
+
+
+class RevokedTokenModel(db.Model):
+    """
+    The jti(unique id) of every JWT revoked by logging out, until that token would have expired anyway.
+    The workers fetch the revocations made since they last looked by created_at(see libs/revocation.py)
+    """
+
+    __tablename__ = "revoked_tokens"
+
+    id = db.Column(db.Integer, primary_key=True)
+    jti = db.Column(db.String(64), nullable=False, unique=True)
+    expires_at = db.Column(db.Integer, nullable=False, index=True)
+    created_at = db.Column(
+        db.Integer, nullable=False, default=lambda: int(time()), server_default="0", index=True
+    )
+
+    @classmethod
+    def find_by_jti(cls, jti: str) -> "RevokedTokenModel":
+        return cls.query.filter_by(jti=jti).first()
+
+    @classmethod
+    def find_since(cls, created_after: int) -> List[Tuple[int, str]]:
+        """
+        (created_at, jti) of the unexpired revocations created at or after `created_after`, no model objects are built
+        """
+        return (
+            db.session.query(cls.created_at, cls.jti)
+            .filter(cls.created_at >= created_after, cls.expires_at >= int(time()))
+            .all()
+        )
+
+    @classmethod
+    def delete_expired(cls) -> int:
+        deleted = cls.query.filter(cls.expires_at < int(time())).delete(
+            synchronize_session=False
+        )
+        db.session.commit()
+        return deleted
+
+    def save_to_db(self) -> None:
+        db.session.add(self)
+        db.session.commit()
+
+    def delete_from_db(self) -> None:
+        db.session.delete(self)
+        db.session.commit()
@@ -1,6 +1,9 @@
-from typing import Dict, List, Union
+from collections import defaultdict
+from typing import Dict, List, Tuple, Union
 from db import db
-from models.item import ItemJSON
+from libs.cache import finder_cache
+from libs.pagination import keyset_page
+from models.item import ItemJSON, ItemModel
 
 # StoreJSON = Dict[str, Union[int, str, List[ItemJSON]]]
 
@@ -24,20 +27,64 @@ class StoreModel(db.Model):
     #         "items": [item.json() for item in self.items.all()],
     #     }
 
+    """
+    `items` is lazy="dynamic" so every access is a fresh query, dumping N stores through StoreSchema would then be
+    1 query for the stores + N queries for their items(the N+1 problem)
+    the finders below load the items of all the stores they return with a single IN query, group them by store_id in
+    python and keep them on the store, StoreSchema reads them through `catalog_items`
+    """
+
+    @property
+    def catalog_items(self) -> List["ItemModel"]:
+        preloaded = self.__dict__.get("_catalog_items")
+        if preloaded is not None:
+            return preloaded
+        return self.items.all()
+
+    @classmethod
+    def _preload_items(cls, stores: List["StoreModel"]) -> List["StoreModel"]:
+        if not stores:
+            return stores
+
+        items_by_store = defaultdict(list)
+        store_ids = [store.id for store in stores]
+        for item in ItemModel.query.filter(ItemModel.store_id.in_(store_ids)).order_by(
+            ItemModel.id
+        ):
+            items_by_store[item.store_id].append(item)
+
+        for store in stores:
+            store._catalog_items = items_by_store[store.id]
+        return stores
+
+    @classmethod
+    @finder_cache.finder("name")
+    def _find_by_name(cls, name: str) -> "StoreModel":
+        return cls.query.filter_by(name=name).first()
+
     @classmethod
     def find_by_name(cls, name: str) -> "StoreModel":
         # def find_by_name(cls, name: str):
-        return cls.query.filter_by(name=name).first()
+        store = cls._find_by_name(name)
+        if store:
+            cls._preload_items([store])
+        return store
 
     @classmethod
     def find_all(cls) -> List["StoreModel"]:
         # def find_all(cls) ->List:
-        return cls.query.all()
+        return cls._preload_items(cls.query.all())
+
+    @classmethod
+    def find_page(
+        cls, limit: int, after: int = None
+    ) -> Tuple[List["StoreModel"], Union[int, None]]:
+        stores, next_cursor = keyset_page(cls.query, cls.id, limit, after)
+        return cls._preload_items(stores), next_cursor
 
+    # both go through the finder cache so that cached lookups of this row are invalidated
     def save_to_db(self) -> None:
-        db.session.add(self)
-        db.session.commit()
+        finder_cache.save(self)
 
     def delete_from_db(self) -> None:
-        db.session.delete(self)
-        db.session.commit()
+        finder_cache.delete(self)
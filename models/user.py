@@ -1,9 +1,12 @@
-from typing import Dict, List, Union
+from typing import Dict, List, Tuple, Union
 from db import db
 from requests import Response
 from flask import request, url_for
+from libs.cache import finder_cache
+from libs.pagination import keyset_page
 from libs.mailgun import Mailgun
 from models.confirmation import ConfirmationModel
+from models.outbox import OutboxEmailModel
 
 # UserJSON = Dict[str, Union[int, str]]
 
@@ -14,7 +17,8 @@ class UserModel(db.Model):
     # # nullable=False, is used to cover up for required=True in our Schema
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), nullable=False, unique=True)
-    password = db.Column(db.Text, nullable=True)
+    # never copied into the finder cache(see libs/cache.py)
+    password = db.Column(db.Text, nullable=True, info={"cache": False})
     DOB = db.Column(db.DateTime, nullable=True)
     email = db.Column(db.String(80), nullable=True, unique=True)
     # default="ogo-oluwa street" will populate the database with the default for user post request
@@ -49,25 +53,109 @@ class UserModel(db.Model):
     # is presumably less likely to be expired when some of the confirmations has expired
     @property
     def most_recent_confirmation(self) -> "ConfirmationModel":
+        # set by _preload_confirmations() when a list of users is loaded, see below
+        if "_most_recent_confirmation" in self.__dict__:
+            return self.__dict__["_most_recent_confirmation"]
         # ordered by expiration time (in descending order)
         return self.confirmation.order_by(db.desc(ConfirmationModel.expire_at)).first()
 
     @classmethod
+    def _preload_confirmations(cls, users: List["UserModel"]) -> List["UserModel"]:
+        """
+        Loads the most recent confirmation of every user in one grouped query, reading most_recent_confirmation on
+        each user would be one query per user
+        """
+        if not users:
+            return users
+
+        latest = (
+            db.session.query(
+                ConfirmationModel.user_id,
+                db.func.max(ConfirmationModel.expire_at).label("expire_at"),
+            )
+            .filter(ConfirmationModel.user_id.in_([user.id for user in users]))
+            .group_by(ConfirmationModel.user_id)
+            .subquery()
+        )
+        confirmations = ConfirmationModel.query.join(
+            latest,
+            db.and_(
+                ConfirmationModel.user_id == latest.c.user_id,
+                ConfirmationModel.expire_at == latest.c.expire_at,
+            ),
+        )
+        by_user = {confirmation.user_id: confirmation for confirmation in confirmations}
+
+        for user in users:
+            user._most_recent_confirmation = by_user.get(user.id)
+        return users
+
+    @classmethod
+    @finder_cache.finder("username")
     def find_by_username(cls, username: str) -> "UserModel":
         # def find_by_username(cls, username: str):
         return cls.query.filter_by(username=username).first()
 
     @classmethod
+    @finder_cache.finder("email")
     def find_by_email(cls, email: str) -> "UserModel":
         return cls.query.filter_by(email=email).first()
 
     @classmethod
+    @finder_cache.finder("id")
     def find_by_id(cls, _id: int) -> "UserModel":
         # def find_by_id(cls, _id: int):
         return cls.query.filter_by(id=_id).first()
 
+    @classmethod
+    def find_page(
+        cls, limit: int, after: int = None
+    ) -> Tuple[List["UserModel"], Union[int, None]]:
+        users, next_cursor = keyset_page(cls.query, cls.id, limit, after)
+        return cls._preload_confirmations(users), next_cursor
+
+    @classmethod
+    def find_for_login(cls, username: str) -> Tuple["UserModel", bool]:
+        """
+        The user and whether their most recent confirmation is confirmed, in one query instead of find_by_username()
+        followed by most_recent_confirmation
+        :return: (None, False) if there is no such user
+        """
+        confirmed = (
+            db.session.query(ConfirmationModel.confirmed)
+            .filter(ConfirmationModel.user_id == cls.id)
+            .order_by(db.desc(ConfirmationModel.expire_at))
+            .limit(1)
+            .correlate(cls)
+            .as_scalar()
+        )
+        row = db.session.query(cls, confirmed).filter(cls.username == username).first()
+        if row is None:
+            return None, False
+        return row[0], bool(row[1])
+
+    def register(self) -> None:
+        """
+        Saves a new user with their first confirmation and queues the confirmation email, all in one transaction, so
+        there is never a user without a confirmation email on its way
+        """
+        try:
+            db.session.add(self)
+            db.session.flush()  # the confirmation needs our id
+            db.session.add(ConfirmationModel(self.id))
+            self.send_confirmation_email(commit=False)
+            self.save_to_db()
+        except:
+            db.session.rollback()
+            raise
+
     # A response is just something that another API gives us
-    def send_confirmation_email(self) -> Response:
+    # def send_confirmation_email(self) -> Response:
+    def send_confirmation_email(self, commit: bool = True) -> OutboxEmailModel:
+        """
+        The email is queued in the outbox and sent by the mail dispatcher(see libs/mail_outbox.py)
+        :param commit: False leaves the commit to the caller, see register()
+        """
         # calculating the link that we want our users to click in that email
         # string[:-1] means copying from start (inclusive) to the last index (exclusive), a more detailed link below:
         # from `http://127.0.0.1:5000/` to `http://127.0.0.1:5000`, since the url_for() would also contain a `/`
@@ -81,14 +169,20 @@ class UserModel(db.Model):
         link = request.url_root[:-1] + url_for(
             "confirmation", confirmation_id=self.most_recent_confirmation.id
         )
-        text = f"Please click the link to confirm your registration: {link}"
-        html = f"<html>Please click the link to confirm your registration: <a href={link}>link</a></html>"
-        return Mailgun.send_email([self.email], subject, text, html)
+        # text = f"Please click the link to confirm your registration: {link}"
+        # html = f"<html>Please click the link to confirm your registration: <a href={link}>link</a></html>"
+        # return Mailgun.send_email([self.email], subject, text, html)
+        # the link goes in a recipient variable, so the confirmation emails of many users share one template and
+        # are sent in one Mailgun request
+        text = "Please click the link to confirm your registration: %recipient.link%"
+        html = "<html>Please click the link to confirm your registration: <a href=%recipient.link%>link</a></html>"
+        return OutboxEmailModel.queue(
+            self.email, subject, text, html, {"link": link}, commit=commit
+        )
 
+    # both go through the finder cache so that cached lookups of this row are invalidated
     def save_to_db(self) -> None:
-        db.session.add(self)
-        db.session.commit()
+        finder_cache.save(self)
 
     def delete_from_db(self) -> None:
-        db.session.delete(self)
-        db.session.commit()
+        finder_cache.delete(self)
@@ -0,0 +1,21 @@
+from flask_restful import Resource
+from flask_jwt_extended import jwt_required, get_jwt_claims
+
+from libs.cache import finder_cache
+from libs.token_cache import token_cache
+from libs.strings import gettext
+
+
+class FinderCacheStats(Resource):
+    @classmethod
+    @jwt_required
+    def get(cls):
+        """
+        Hit/miss counters of the finder cache and of the JWT decode cache, used for tuning FINDER_CACHE_SIZE,
+        FINDER_CACHE_TTL and JWT_DECODE_CACHE_SIZE.
+        This endpoint is only for admins and should not be exposed to public.
+        """
+        claims = get_jwt_claims()
+        if not claims["is_admin"]:
+            return {"message": gettext("admin_previlege_required")}, 401
+        return {**finder_cache.stats(), "jwt_decode": token_cache.stats()}, 200
@@ -11,7 +11,6 @@ from flask_jwt_extended import (
 from models.confirmation import ConfirmationModel
 from schemas.confirmation import ConfirmationSchema
 from models.user import UserModel
-from libs.mailgun import MailGunException
 from libs.strings import gettext
 
 
@@ -99,8 +98,9 @@ class ConfirmationByUser(Resource):
             # An excellent example where lazy='dynamic' comes into use.
             user.send_confirmation_email()  # re-send the confirmation email
             return {"message": gettext("confirmation_resend_successful")}, 201
-        except MailGunException as e:
-            return {"message": str(e)}, 500
+        # except MailGunException as e:
+        #     return {"message": str(e)}, 500
+        # the email is only queued in the outbox now(see libs/mail_outbox.py), Mailgun errors can no longer reach here
         except:
             traceback.print_exc()
             return {"message": gettext("confirmation_resend_fail")}, 500
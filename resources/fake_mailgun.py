@@ -0,0 +1,57 @@
+import json
+from threading import Lock
+from time import time
+from uuid import uuid4
+
+from flask import request
+from flask_restful import Resource
+
+"""
+A local stand-in for Mailgun's messages endpoint, so the mail dispatcher can be run and tested without a Mailgun
+account. It is only registered when MAILGUN_FAKE=True, point the client at it with
+    MAILGUN_API_BASE=http://127.0.0.1:5000/fake-mailgun/v3
+Every accepted message is kept in memory with its recipient variables already substituted, GET lists them.
+"""
+
+FAKE_MAILBOX = []
+_mailbox_lock = Lock()
+
+
+class FakeMailgunMessages(Resource):
+    @classmethod
+    def post(cls, domain: str):
+        if request.authorization is None or request.authorization.username != "api":
+            return {"message": "Forbidden"}, 401
+
+        recipients = request.form.getlist("to")
+        if not recipients or not request.form.get("from") or not request.form.get("subject"):
+            return {"message": "'from', 'to' and 'subject' are required"}, 400
+        try:
+            variables = json.loads(request.form.get("recipient-variables", "{}"))
+        except ValueError:
+            return {"message": "'recipient-variables' must be valid JSON"}, 400
+
+        message_id = f"<{uuid4().hex}@{domain}>"
+        with _mailbox_lock:
+            for recipient in recipients:
+                text = request.form.get("text", "")
+                html = request.form.get("html", "")
+                for name, value in variables.get(recipient, {}).items():
+                    text = text.replace(f"%recipient.{name}%", str(value))
+                    html = html.replace(f"%recipient.{name}%", str(value))
+                FAKE_MAILBOX.append(
+                    {
+                        "id": message_id,
+                        "domain": domain,
+                        "to": recipient,
+                        "subject": request.form["subject"],
+                        "text": text,
+                        "html": html,
+                        "received_at": int(time()),
+                    }
+                )
+        return {"id": message_id, "message": "Queued. Thank you."}, 200
+
+    @classmethod
+    def get(cls, domain: str):
+        return {"messages": [message for message in FAKE_MAILBOX if message["domain"] == domain]}, 200
@@ -3,10 +3,18 @@ import traceback
 
 from flask_restful import Resource
 from flask_uploads import UploadNotAllowed
-from flask import request, send_file
+from flask import request, send_file, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
 
 from libs import image_helper
+from libs.avatar_manifest import avatar_manifest
+from libs.image_response import content_etag, send_image
+from libs.image_derivatives import (
+    derivative_store,
+    get_derivative_args,
+    DerivativeException,
+    UnreadableImageException,
+)
 from libs.strings import gettext
 from schemas.image import ImageSchema
 
@@ -62,7 +70,18 @@ class Image(Resource):
             return {"message": gettext("image_illegal_file_name").format(filename)}, 400
         try:
             # try to send the requested file to the user with status code 200
-            return send_file(image_helper.get_path(filename, folder=folder))
+            # return send_file(image_helper.get_path(filename, folder=folder))
+            # with validators and Range support, 304 when the client has it already(see libs/image_response.py)
+            path = image_helper.get_path(filename, folder=folder)
+            stat = os.stat(path)
+            return send_image(
+                path,
+                content_etag(path, stat),
+                stat.st_size,
+                stat.st_mtime,
+                current_app.config["IMAGE_CACHE_MAX_AGE"],
+                private=True,
+            )
         except FileNotFoundError:
             return {"message": gettext("image_not_found").format(filename)}, 404
 
@@ -90,6 +109,48 @@ class Image(Resource):
             return {"message": gettext("image_delete_failed")}, 500
 
 
+class ImageDerivative(Resource):
+    @classmethod
+    @jwt_required
+    def get(cls, filename: str):
+        """
+        This endpoint returns a resized/re-encoded version of one of the user's images, e.g a thumbnail with
+        ?width=200&format=webp. It takes ?width=, ?height=, ?format=(jpeg, png or webp) and ?quality=(1 to 95),
+        the image is scaled down to fit in width x height keeping its aspect ratio.
+        """
+        user_id = get_jwt_identity()
+        folder = f"user_{user_id}"
+        if not image_helper.is_filename_safe(filename):
+            return {"message": gettext("image_illegal_file_name").format(filename)}, 400
+        try:
+            args = get_derivative_args(current_app.config["IMAGE_DERIVATIVE_MAX_DIMENSION"])
+        except DerivativeException as e:
+            return {"message": str(e)}, 400
+
+        try:
+            path = image_helper.get_path(filename, folder=folder)
+            stat = os.stat(path)
+            derivative, key = derivative_store.get(path, content_etag(path, stat), args)
+            derivative_stat = os.stat(derivative)
+            # derivatives live outside UPLOADED_IMAGES_DEST, the worker sends them itself
+            return send_image(
+                derivative,
+                key,
+                derivative_stat.st_size,
+                derivative_stat.st_mtime,
+                current_app.config["IMAGE_CACHE_MAX_AGE"],
+                private=True,
+                allow_offload=False,
+            )
+        except FileNotFoundError:
+            return {"message": gettext("image_not_found").format(filename)}, 404
+        except ImportError:  # Pillow is not installed
+            traceback.print_exc()
+            return {"message": gettext("image_derivative_unavailable")}, 501
+        except UnreadableImageException:  # not an image Pillow can read(e.g svg), or a decompression bomb
+            return {"message": gettext("image_derivative_failed").format(filename)}, 400
+
+
 class AvatarUpload(Resource):
     @classmethod
     @jwt_required
@@ -100,14 +161,19 @@ class AvatarUpload(Resource):
         It will overwrite the existing avatar if it exist or create new one if it does not exist.
         """
         data = image_schema.load(request.files)
-        filename = f"user_{get_jwt_identity()}"
+        user_id = get_jwt_identity()
+        filename = f"user_{user_id}"
         folder = "avatars"
-        avatar_path = image_helper.find_image_any_format(filename, folder)
-        if avatar_path:
+        # avatar_path = image_helper.find_image_any_format(filename, folder)
+        current = avatar_manifest.get(user_id)
+        if current:
             try:
-                os.remove(avatar_path)
+                os.remove(current["path"])
+            except FileNotFoundError:
+                pass  # already gone, we only want it out of the way
             except:
                 return {"message": gettext("avatar_delete_failed")}, 500
+            avatar_manifest.remove(user_id, current["path"])
 
         try:
             ext = image_helper.get_extension(data["image"].filename)
@@ -115,6 +181,7 @@ class AvatarUpload(Resource):
             avatar_path = image_helper.save_image(
                 data["image"], folder=folder, name=avatar
             )
+            avatar_manifest.set(user_id, image_helper.get_path(avatar_path))
             basename = image_helper.get_basename(avatar_path)
             return {"message": gettext("avatar_uploaded").format(basename)}, 200
         except UploadNotAllowed:  # forbidden file type
@@ -131,9 +198,29 @@ class Avatar(Resource):
         """
         This endpoint returns the avatar of the user specified by user_id.
         """
-        folder = "avatars"
-        filename = f"user_{user_id}"
-        avatar = image_helper.find_image_any_format(filename, folder)
-        if avatar:
-            return send_file(avatar)
+        # folder = "avatars"
+        # filename = f"user_{user_id}"
+        # avatar = image_helper.find_image_any_format(filename, folder)
+        # if avatar:
+        #     return send_file(avatar)
+        # return {"message": gettext("avatar_not_found")}, 404
+
+        # the manifest knows where the avatar is and its size, mtime and etag, no stat() is needed to serve it
+        for _ in range(2):
+            avatar = avatar_manifest.get(user_id)
+            if not avatar:
+                break
+            try:
+                return send_image(
+                    avatar["path"],
+                    avatar["etag"],
+                    avatar["size"],
+                    avatar["mtime"],
+                    current_app.config["AVATAR_CACHE_MAX_AGE"],
+                )
+            except FileNotFoundError:
+                # deleted behind the manifest's back, or our copy of the manifest is behind another worker's upload of
+                # an avatar with another extension. remove() re-reads the manifest and only drops the entry if it
+                # still points to the missing file, the retry then serves the new avatar if there is one
+                avatar_manifest.remove(user_id, avatar["path"])
         return {"message": gettext("avatar_not_found")}, 404
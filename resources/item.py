@@ -11,6 +11,8 @@ from marshmallow import ValidationError
 from models.item import ItemModel
 from schemas.item import ItemSchema
 from libs.strings import gettext
+from libs.schema_compiler import compile_schema
+from libs.pagination import is_paginated, get_page_args, PaginationException
 
 
 """
@@ -27,8 +29,8 @@ fresh token = A token you have currently received after entering your username a
 non-fresh token = A token you received by refreshing a previous token
 """
 
-item_schema = ItemSchema()
-item_list_schema = ItemSchema(many=True)
+item_schema = compile_schema(ItemSchema())
+item_list_schema = compile_schema(ItemSchema(many=True))
 
 
 class Item(Resource):
@@ -144,17 +146,34 @@ class ItemList(Resource):
     @classmethod
     @jwt_optional
     def get(cls):
+        """
+        Returns every item, or a single page of items when ?limit= and/or ?after= are sent.
+        The paginated response carries a `next` cursor to pass as ?after= for the following page(None on the last one)
+        """
         user_id = get_jwt_identity()
         # items = [item.json() for item in ItemModel.query.all()]
         # items = [item.json() for item in ItemModel.find_all()]
         # items = [item_schema.dump(item) for item in ItemModel.find_all()]
-        items = item_list_schema.dump(ItemModel.find_all())
-        if user_id:
-            return {"items": items}, 200
-        return (
-            {
-                "items": [item["name"] for item in items],
-                "message": gettext("login_required"),
-            },
-            200,
-        )
+        page = {}
+        if is_paginated():
+            try:
+                limit, after = get_page_args()
+            except PaginationException as e:
+                return {"message": str(e)}, 400
+
+        # anonymous users only ever see the names, so we only select the names(no ORM objects, no schema dump)
+        if not user_id:
+            if is_paginated():
+                names, page["next"] = ItemModel.find_names_page(limit, after)
+            else:
+                names = ItemModel.find_all_names()
+            return (
+                {"items": names, "message": gettext("login_required"), **page},
+                200,
+            )
+
+        if is_paginated():
+            found, page["next"] = ItemModel.find_page(limit, after)
+        else:
+            found = ItemModel.find_all()
+        return {"items": item_list_schema.dump(found), **page}, 200
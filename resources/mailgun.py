@@ -0,0 +1,19 @@
+from flask_restful import Resource
+from flask_jwt_extended import jwt_required, get_jwt_claims
+
+from libs.mailgun import Mailgun
+from libs.strings import gettext
+
+
+class MailgunStats(Resource):
+    @classmethod
+    @jwt_required
+    def get(cls):
+        """
+        Call counters(sent, retried, rejected, failed) and latency histogram of the Mailgun client.
+        This endpoint is only for admins and should not be exposed to public.
+        """
+        claims = get_jwt_claims()
+        if not claims["is_admin"]:
+            return {"message": gettext("admin_previlege_required")}, 401
+        return Mailgun.stats(), 200
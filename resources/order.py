@@ -1,15 +1,33 @@
 from collections import Counter
-from flask import request
+from flask import request, current_app
 from flask_restful import Resource
+from flask_jwt_extended import jwt_optional, get_jwt_identity
 
 from stripe import error
 from libs.strings import gettext
+from libs.schema_compiler import compile_schema
+from libs.pagination import is_paginated, get_page_args, PaginationException
+from models.charge_job import ChargeJobModel
+from models.idempotency import IdempotentResponseModel
 from models.item import ItemModel
-from models.order import OrderModel, ItemsInOrder
+from models.order import OrderModel, ItemsInOrder, PENDING, ORDER_TRANSITIONS
 from schemas.order import OrderSchema
 
-order_schema = OrderSchema()
-multiple_order_schema = OrderSchema(many=True)
+order_schema = compile_schema(OrderSchema())
+multiple_order_schema = compile_schema(OrderSchema(many=True))
+
+
+def _item_id(_id):
+    """
+    "1" is item 1, as it was when every item was looked up with ItemModel.find_by_id, anything that is not an integer
+    is left as is and reported missing
+    """
+    if isinstance(_id, str):
+        try:
+            return int(_id)
+        except ValueError:
+            pass
+    return _id
 
 
 class Order(Resource):
@@ -18,47 +36,119 @@ class Order(Resource):
         """
         This endpoint is solely for testing purpose so that we can get a better idea what is happening
         for each successful/failed charge.
+        ?status= only returns the orders in that status, ?limit= and/or ?after= return one page of orders, newest
+        first, with a `next` cursor to pass as ?after= for the following page
         :return: a list of all orders
         """
+        status = request.args.get("status")
+        if status is not None and status not in ORDER_TRANSITIONS:
+            return {"message": gettext("order_invalid_status").format(status)}, 400
+
+        if is_paginated():
+            try:
+                limit, after = get_page_args()
+            except PaginationException as e:
+                return {"message": str(e)}, 400
+            orders, next_cursor = OrderModel.find_page(limit, after, status)
+            return {"orders": multiple_order_schema.dump(orders), "next": next_cursor}, 200
+
         # You could also define a `OrderSchema(many=True)` above, like we did for items and stores!
         # return multiple_order_schema.dump(OrderModel.find_all()), 200
-        return order_schema.dump(OrderModel.find_all(), many=True), 200
+        return order_schema.dump(OrderModel.find_all(status), many=True), 200
 
     @classmethod
+    @jwt_optional
     def post(cls):
         """
         Expect a token and a list of item ids from the request body.
         Construct an order and talk to the Strip API to make a charge.
+        A client retrying a checkout should send the same `Idempotency-Key` header, the response to the first request
+        with that key is then replayed without creating a second order or charge. Keys belong to the logged in user,
+        or to the client's address for anonymous checkouts, and can only be reused for the same request body.
         USE CTRL+ENTER TO IMPORT A MODULE WHEN USED
         """
+        key = request.headers.get("Idempotency-Key")
+        if key is None:
+            return cls._place_order()
+        if not 0 < len(key) <= 255:
+            return {"message": gettext("order_idempotency_key_invalid")}, 400
+
+        user_id = get_jwt_identity()
+        owner = f"user:{user_id}" if user_id is not None else f"ip:{request.remote_addr}"
+        fingerprint = IdempotentResponseModel.fingerprint_of(owner, request.get_data())
+
+        stored = IdempotentResponseModel.find_by_key(owner, key)
+        if stored and stored.fingerprint != fingerprint:
+            return {"message": gettext("order_idempotency_key_reused")}, 422
+        if stored and stored.completed:
+            return stored.response  # replayed, no item is queried and Stripe is not called again
+        if stored is None:
+            reserved = IdempotentResponseModel.reserve(owner, key, fingerprint)
+        elif stored.lease_expired:
+            # the worker processing the first request died without releasing the key
+            reserved = stored.take_over()
+        else:
+            reserved = None
+        if reserved is None:
+            # the first request with this key is still being processed
+            return {"message": gettext("order_idempotency_in_progress")}, 409
+
+        try:
+            body, status = cls._place_order()
+        except Exception:
+            reserved.release()
+            raise
+        if status is None or status >= 500 or status == 429:
+            # transient failures are not stored so that retrying them can succeed
+            reserved.release()
+        else:
+            reserved.complete(body, status)
+        return body, status
+
+    @classmethod
+    def _place_order(cls):
         data = request.get_json()  # token + list of item ids  [1, 2, 3, 5, 5, 5]
-        items = []
-        item_id_quantities = Counter(data["item_ids"])
-
-        # iterate over the items and retrieve them from the database
-        # for _id in data["item_ids"]:
-        for _id, count in item_id_quantities.most_common():
-            item = ItemModel.find_by_id(_id)
-            if not item:
-                return (
-                    {"message": gettext("order_item_by_id_not_found").format(_id)},
-                    404,
-                )
-
-            # items.append(item)
-            items.append(ItemsInOrder(item_id=_id, quantity=count))
+        item_id_quantities = Counter(_item_id(_id) for _id in data["item_ids"])
+
+        # retrieve every item of the order with one query instead of one query per item id
+        found = ItemModel.find_by_ids(
+            [_id for _id in item_id_quantities if isinstance(_id, int)]
+        )
+        missing = [_id for _id in item_id_quantities if _id not in found]
+        if missing:
+            return (
+                {
+                    "message": gettext("order_items_by_id_not_found").format(
+                        ", ".join(str(_id) for _id in missing)
+                    ),
+                    "missing_item_ids": missing,
+                },
+                404,
+            )
+
+        items = [
+            ItemsInOrder(item=found[_id], quantity=count)
+            for _id, count in item_id_quantities.most_common()
+        ]
 
         order = OrderModel(
-            items=items, status="pending"
+            items=items, status=PENDING
         )  # this does not submit to Stripe
+
+        if current_app.config.get("ORDER_ASYNC_CHECKOUT"):
+            # the order and its charge job are committed together, a charge worker makes the charge later
+            # and the client polls the order for its final status
+            ChargeJobModel(order=order, token=data["token"]).save_to_db()
+            return (
+                {"message": gettext("order_queued"), **order_schema.dump(order)},
+                202,
+            )
+
         order.save_to_db()
 
         try:
-            order.set_status(
-                "failed"
-            )  # assume the order would fail until it's completed
-            order.charge_with_stripe(data["token"])
-            order.set_status("complete")  # charge succeeded
+            # charges and commits the order as complete, or as failed if the charge raises
+            order.checkout(data["token"])
             return order_schema.dump(order), 200
         # the following error handling is advised by Stripe, although the handling implementations are identical,
         # we choose to specify them separately just to give the students a better idea what we can expect
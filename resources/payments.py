@@ -0,0 +1,19 @@
+from flask_restful import Resource
+from flask_jwt_extended import jwt_required, get_jwt_claims
+
+from libs import payments
+from libs.strings import gettext
+
+
+class PaymentClientStats(Resource):
+    @classmethod
+    @jwt_required
+    def get(cls):
+        """
+        Circuit breaker state, call counters and latency histogram of the Stripe client.
+        This endpoint is only for admins and should not be exposed to public.
+        """
+        claims = get_jwt_claims()
+        if not claims["is_admin"]:
+            return {"message": gettext("admin_previlege_required")}, 401
+        return payments.payment_client.stats(), 200
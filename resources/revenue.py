@@ -0,0 +1,71 @@
+from datetime import date, datetime, timedelta
+from typing import Tuple
+
+from flask import request
+from flask_restful import Resource
+from flask_jwt_extended import jwt_required, get_jwt_claims
+
+from libs.strings import gettext
+from models.order import COMPLETE, ORDER_TRANSITIONS
+from models.revenue import RevenueByDayModel, RevenueByItemDayModel
+from schemas.revenue import RevenueByDaySchema, RevenueByItemDaySchema
+
+DEFAULT_RANGE_DAYS = 30
+
+revenue_by_day_list_schema = RevenueByDaySchema(many=True)
+revenue_by_item_day_list_schema = RevenueByItemDaySchema(many=True)
+
+"""
+These endpoints read the revenue rollups(see models/revenue.py), so a report costs one row per day in the range no
+matter how many orders were placed. Revenue is in cents.
+?status= defaults to complete, ?from= and ?to= are ISO dates(YYYY-MM-DD) and default to the last 30 days.
+They are only for admins.
+"""
+
+
+def _report_args() -> Tuple[str, date, date]:
+    status = request.args.get("status", COMPLETE)
+    if status not in ORDER_TRANSITIONS:
+        raise ValueError(gettext("order_invalid_status").format(status))
+    try:
+        end = datetime.utcnow().date()
+        if "to" in request.args:
+            end = date.fromisoformat(request.args["to"])
+        start = end - timedelta(days=DEFAULT_RANGE_DAYS - 1)
+        if "from" in request.args:
+            start = date.fromisoformat(request.args["from"])
+    except ValueError:
+        raise ValueError(gettext("revenue_invalid_date"))
+    return status, start, end
+
+
+class RevenueByDay(Resource):
+    @classmethod
+    @jwt_required
+    def get(cls):
+        claims = get_jwt_claims()
+        if not claims["is_admin"]:
+            return {"message": gettext("admin_previlege_required")}, 401
+        try:
+            status, start, end = _report_args()
+        except ValueError as e:
+            return {"message": str(e)}, 400
+
+        days = RevenueByDayModel.find_range(status, start, end)
+        return {"days": revenue_by_day_list_schema.dump(days)}, 200
+
+
+class RevenueByItem(Resource):
+    @classmethod
+    @jwt_required
+    def get(cls, item_id: int):
+        claims = get_jwt_claims()
+        if not claims["is_admin"]:
+            return {"message": gettext("admin_previlege_required")}, 401
+        try:
+            status, start, end = _report_args()
+        except ValueError as e:
+            return {"message": str(e)}, 400
+
+        days = RevenueByItemDayModel.find_range(item_id, status, start, end)
+        return {"days": revenue_by_item_day_list_schema.dump(days)}, 200
@@ -2,14 +2,16 @@ from flask_restful import Resource
 from models.store import StoreModel
 from schemas.store import StoreSchema
 from libs.strings import gettext
+from libs.schema_compiler import compile_schema
+from libs.pagination import is_paginated, get_page_args, PaginationException
 
 NAME_ALREADY_EXISTS = "A store with name '{}' already exists."
 ERROR_INSERTING = "An error occurred while inserting the store."
 STORE_NOT_FOUND = "Store not found."
 STORE_DELETED = "Store deleted."
 
-store_schema = StoreSchema()
-store_list_schema = StoreSchema(many=True)
+store_schema = compile_schema(StoreSchema())
+store_list_schema = compile_schema(StoreSchema(many=True))
 
 
 class Store(Resource):
@@ -65,4 +67,11 @@ class StoreList(Resource):
     def get(cls):
         # return {'stores': [store.json() for store in StoreModel.query.all()]}
         # return {"stores": [store.json() for store in StoreModel.find_all()]}
+        if is_paginated():
+            try:
+                limit, after = get_page_args()
+            except PaginationException as e:
+                return {"message": str(e)}, 400
+            stores, next_cursor = StoreModel.find_page(limit, after)
+            return {"stores": store_list_schema.dump(stores), "next": next_cursor}, 200
         return {"stores": store_list_schema.dump(StoreModel.find_all())}, 200
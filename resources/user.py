@@ -1,6 +1,6 @@
 from flask import request, render_template, make_response, redirect, g
 from flask_restful import Resource, reqparse
-from werkzeug.security import safe_str_cmp, generate_password_hash, check_password_hash
+from werkzeug.security import safe_str_cmp
 import traceback
 
 # bracket is required for multi line import
@@ -12,12 +12,15 @@ from flask_jwt_extended import (
     get_raw_jwt,
     jwt_required,
     fresh_jwt_required,
+    get_jwt_claims,
 )
 from models.user import UserModel
 from schemas.user import UserSchema
 from blacklist import BLACKLIST
 from marshmallow import ValidationError
-from libs.mailgun import MailGunException
+from libs import passwords
+from libs.rate_limit import rate_limited
+from libs.pagination import get_page_args, PaginationException
 from models.confirmation import ConfirmationModel
 from libs.strings import gettext
 from libs.test_flask_lib import function_accessing_global
@@ -39,10 +42,12 @@ USER_LOGGED_OUT = "User <id={user_id}> successfully logged out."
 
 
 user_schema = UserSchema()
+user_list_schema = UserSchema(many=True)
 
 
 class UserRegister(Resource):
     @classmethod
+    @rate_limited("register")
     def post(cls):
         # data = _user_parser.parse_args()
 
@@ -76,26 +81,37 @@ class UserRegister(Resource):
 
         # return {"message": gettext("user_created_successfully")}, 201
 
+        # try:
+        #     user.password = generate_password_hash(user.password)
+        #     user.save_to_db()
+        #     confirmation = ConfirmationModel(user.id)
+        #     confirmation.save_to_db()
+        #     user.send_confirmation_email()
+        #     return {"message": gettext("user_registered")}, 201
+        # except MailGunException as e:
+        #     user.delete_from_db()  # rollback
+        #     # return {"message": e.message}, 500
+        #     return {"message": str(e)}, 500
+        # except:  # failed to save user to db
+        #     traceback.print_exc()
+        #     user.delete_from_db()  # rollback if confirmation.save_to_db() fails
+        #     return {"message": gettext("user_error_creating")}, 500
+
+        # the user, the confirmation and the confirmation email(queued in the outbox) are saved in one transaction,
+        # Mailgun is no longer called during the request so its slowdowns can not fail registrations
         try:
-            user.password = generate_password_hash(user.password)
-            user.save_to_db()
-            confirmation = ConfirmationModel(user.id)
-            confirmation.save_to_db()
-            user.send_confirmation_email()
+            user.password = passwords.password_hasher.hash(user.password)
+            user.register()
             return {"message": gettext("user_registered")}, 201
-        except MailGunException as e:
-            user.delete_from_db()  # rollback
-            # return {"message": e.message}, 500
-            return {"message": str(e)}, 500
-        except:  # failed to save user to db
+        except:  # failed to save user to db, register() has rolled everything back
             traceback.print_exc()
-            user.delete_from_db()  # rollback if confirmation.save_to_db() fails
             return {"message": gettext("user_error_creating")}, 500
 
 
 # This is doing what the authenticate() function inside security.py is doing with different library(JWTManager)
 class UserLogin(Resource):
     @classmethod
+    @rate_limited("login")
     def post(cls):
         # data = _user_parser.parse_args()
 
@@ -120,18 +136,25 @@ class UserLogin(Resource):
 
         # user = UserModel.find_by_username(data["username"])
         # user = UserModel.find_by_username(user_data["username"])
-        user = UserModel.find_by_username(user_data.username)
+        # user = UserModel.find_by_username(user_data.username)
+        # the user and the state of their most recent confirmation, in one query
+        user, confirmed = UserModel.find_for_login(user_data.username)
 
         # # This is what the authenticate() function used to do
-        if not user.password:
+        if user and not user.password:
             return {"message": gettext("github_login")}, 400
         # if user and safe_str_cmp(user.password, data["password"]):
-        if user and check_password_hash(user.password, user_data.password):
+        if user and passwords.password_hasher.verify(user.password, user_data.password):
+            # hashes made with an older work factor are upgraded while we have the plaintext password
+            if passwords.password_hasher.needs_rehash(user.password):
+                user.password = passwords.password_hasher.hash(user_data.password)
+                user.save_to_db()
             # if user and safe_str_cmp(user_data.password, user.password):
             # This is what the identity() function used to do
             # if user.activated:
-            confirmation = user.most_recent_confirmation
-            if confirmation and confirmation.confirmed:
+            # confirmation = user.most_recent_confirmation
+            # if confirmation and confirmation.confirmed:
+            if confirmed:
                 access_token = create_access_token(identity=user.id, fresh=True)
                 refresh_token = create_refresh_token(user.id)
                 # global variable
@@ -155,8 +178,10 @@ class UserLogout(Resource):
         # # we could have used user_id = get_jwt_identity() had it been we are to blacklist a user by its id
         user_id = get_jwt_identity()
         # BLACKLIST.add(user_id)
-        jti = get_raw_jwt()["jti"]  # jti(JWT ID) is a raw token unique identifier
-        BLACKLIST.add(jti)
+        raw_jwt = get_raw_jwt()
+        jti = raw_jwt["jti"]  # jti(JWT ID) is a raw token unique identifier
+        # the token only has to stay revoked until it expires(exp)
+        BLACKLIST.add(jti, raw_jwt.get("exp"))
         # return {"message": gettext("user_logged_out").format(jti)}, 200
         return {"message": gettext("user_logged_out").format(user_id)}, 200
 
@@ -187,10 +212,31 @@ class User(Resource):
         return {"message": gettext("user_deleted")}, 200
 
 
+class UserList(Resource):
+    @classmethod
+    @jwt_required
+    def get(cls):
+        """
+        Pages through all the users with ?limit= and ?after=, each with their most recent confirmation.
+        This endpoint is only for admins and should not be exposed to public.
+        """
+        claims = get_jwt_claims()
+        if not claims["is_admin"]:
+            return {"message": gettext("admin_previlege_required")}, 401
+
+        try:
+            limit, after = get_page_args()
+        except PaginationException as e:
+            return {"message": str(e)}, 400
+        users, next_cursor = UserModel.find_page(limit, after)
+        return {"users": user_list_schema.dump(users), "next": next_cursor}, 200
+
+
 # here, the refresh token is supplied to the "TokenRefresh()" resource to create a non-fresh access token
 # this allows for new token to be generated without asking the user for his/her username and password
 class TokenRefresh(Resource):
     @classmethod
+    @rate_limited("refresh")
     @jwt_refresh_token_required
     def post(cls):
         current_user = get_jwt_identity()
@@ -236,7 +282,7 @@ class SetPassword(Resource):
         if not user:
             return {"message": gettext("user_not_found")}, 400
 
-        user.password = generate_password_hash(user_data.password)
+        user.password = passwords.password_hasher.hash(user_data.password)
         user.save_to_db()
 
         return {"message": gettext("user_password_updated")}, 201
@@ -15,7 +15,7 @@ class FileStorageField(fields.Field):
     default_error_messages = {"invalid": "Not a valid image."}
 
     # this validation is only to verify and validate that the image exist
-    def _deserialize(self, value, attr, data) -> FileStorage:
+    def _deserialize(self, value, attr, data, **kwargs) -> FileStorage:
         if value is None:
             return None
 
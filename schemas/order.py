@@ -6,6 +6,7 @@ class OrderSchema(ma.ModelSchema):
     class Meta:
         model = OrderModel
         load_only = ("token",)
+        exclude = ("charge_key",)  # the Stripe idempotency key stays server side
         dump_only = (
             "id",
             "status",
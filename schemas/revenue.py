@@ -0,0 +1,15 @@
+from ma import ma
+from models.revenue import RevenueByDayModel, RevenueByItemDayModel
+
+
+class RevenueByDaySchema(ma.ModelSchema):
+    class Meta:
+        model = RevenueByDayModel
+        exclude = ("id",)
+
+
+class RevenueByItemDaySchema(ma.ModelSchema):
+    class Meta:
+        model = RevenueByItemDayModel
+        exclude = ("id",)
+        include_fk = True
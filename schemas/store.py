@@ -5,7 +5,10 @@ from schemas.item import ItemSchema
 
 
 class StoreSchema(ma.ModelSchema):
-    items = ma.Nested(ItemSchema, many=True)
+    # read from the bulk loaded items(see StoreModel.catalog_items) so dumping a list of stores is not N+1
+    items = ma.Nested(
+        ItemSchema, many=True, attribute="catalog_items", dump_only=True
+    )
 
     class Meta:
         model = StoreModel
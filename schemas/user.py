@@ -1,4 +1,5 @@
 # from marshmallow import Schema, fields
+from typing import List
 from marshmallow import pre_dump
 from ma import ma
 from models.user import UserModel
@@ -16,14 +17,23 @@ from models.user import UserModel
 
 # # using flask marshmallow library begat the code below
 class UserSchema(ma.ModelSchema):
+    # this will help return a user with most recent confirmation and not all confirmations
+    # it is read from most_recent_confirmation, which UserModel.find_page() loads for the whole page in one query
+    confirmation = ma.Method("_most_recent_confirmation", dump_only=True)
+
     class Meta:
         model = UserModel
         load_only = ("password",)
         dump_only = ("id", "confirmation")
 
-        # this will help return a user with most recent confirmation and not all confirmations
-        # the user we are passing into the below function is the one we are about to convert to json
-        @pre_dump
-        def _pre_dump(self, user: UserModel):
-            user.confirmation = [user.most_recent_confirmation]
-            return user
+        # # replaced by the `confirmation` field above, assigning to the relationship would also have deleted the
+        # # other confirmations(delete-orphan)
+        # @pre_dump
+        # def _pre_dump(self, user: UserModel):
+        #     user.confirmation = [user.most_recent_confirmation]
+        #     return user
+
+    @staticmethod
+    def _most_recent_confirmation(user: UserModel) -> List[str]:
+        confirmation = user.most_recent_confirmation
+        return [confirmation.id] if confirmation else []
@@ -0,0 +1,19 @@
+import os
+import tempfile
+
+"""
+Settings the tests run the app with(APPLICATION_SETTINGS, see conftest.py), an in-memory database and no background
+threads or outside services
+"""
+
+DEBUG = False
+SQLALCHEMY_DATABASE_URI = "sqlite://"
+STRIPE_FAKE = True
+MAIL_DISPATCHER = False
+CONFIRMATION_PURGE_INTERVAL = 0
+REVOCATION_PURGE_INTERVAL = 0
+ORDER_RECOVERY_INTERVAL = 0
+RATE_LIMIT_ENABLED = False
+UPLOADED_IMAGES_DEST = os.path.join(tempfile.gettempdir(), "flask_api_tests", "images")
+AVATAR_MANIFEST_PATH = os.path.join(UPLOADED_IMAGES_DEST, "avatar_manifest.json")
+IMAGE_DERIVATIVE_CACHE_DIR = os.path.join(tempfile.gettempdir(), "flask_api_tests", "derivatives")
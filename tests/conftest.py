@@ -0,0 +1,68 @@
+import os
+import sys
+
+import pytest
+
+"""
+The app reads its settings and strings relative to the project folder and needs these environment variables before
+it is imported, the tests run it with tests/config.py
+"""
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(ROOT)
+sys.path.insert(0, ROOT)
+os.environ["APPLICATION_SETTINGS"] = os.path.join(ROOT, "tests", "config.py")
+for name in ("JWT_SECRET_KEY", "APP_SECRET_KEY", "GITHUB_CONSUMER_KEY", "GITHUB_CONSUMER_SECRET"):
+    os.environ.setdefault(name, "test")
+
+from db import metadata
+
+# sqlite has no native boolean, SQLAlchemy emits an unnamed CHECK constraint for it that the "ck" convention can not name
+metadata.naming_convention.pop("ck", None)
+
+
+@pytest.fixture(scope="session")
+def app():
+    from app import app as flask_app
+    from db import db
+    from ma import ma
+
+    db.init_app(flask_app)
+    ma.init_app(flask_app)
+    return flask_app
+
+
+@pytest.fixture
+def client(app):
+    from db import db
+    from libs.cache import finder_cache
+
+    with app.app_context():
+        # the startup jobs(app.create_tables) run now, not inside the first request of the test
+        app.try_trigger_before_first_request_functions()
+        db.drop_all()
+        db.create_all()
+    finder_cache.clear()
+    return app.test_client()
+
+
+@pytest.fixture
+def query_counter(app):
+    """
+    Counts the SQL statements run while the test runs, read `query_counter.count`
+    """
+    from sqlalchemy import event
+    from db import db
+
+    class Counter:
+        count = 0
+
+        def __call__(self, *args):
+            self.count += 1
+
+    counter = Counter()
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, "before_cursor_execute", counter)
+    yield counter
+    event.remove(engine, "before_cursor_execute", counter)
@@ -0,0 +1,54 @@
+from models.confirmation import ConfirmationModel
+from models.user import UserModel
+
+
+def add_user(username: str) -> UserModel:
+    user = UserModel(username=username, email=f"{username}@x", password="x")
+    user.save_to_db()
+    return user
+
+
+def add_confirmation(user: UserModel, expire_at: int, confirmed: bool = False) -> ConfirmationModel:
+    confirmation = ConfirmationModel(user.id)
+    confirmation.expire_at = expire_at
+    confirmation.confirmed = confirmed
+    confirmation.save_to_db()
+    return confirmation
+
+
+def test_purge_keeps_the_latest_confirmation_of_each_user(app, client):
+    with app.app_context():
+        resent = add_user("resent")
+        for expire_at in (1000, 1001, 1002):
+            add_confirmation(resent, expire_at)
+        confirmed = add_user("confirmed")
+        add_confirmation(confirmed, 1000, confirmed=True)
+        add_confirmation(confirmed, 1001)
+        idle = add_user("idle")
+        only = add_confirmation(idle, 1000)
+
+        assert ConfirmationModel.purge_expired(batch_size=1) == 2
+        assert resent.most_recent_confirmation.expire_at == 1002
+        assert confirmed.most_recent_confirmation.expire_at == 1001
+        assert idle.most_recent_confirmation.id == only.id
+
+    # the user whose only link expired can still get a new one
+    response = client.post(f"/confirmation/user/{idle.id}")
+    assert response.status_code == 201
+
+
+def test_purge_command_reads_the_batch_size_from_the_config(app, client, monkeypatch):
+    batch_sizes = []
+    purge_expired = ConfirmationModel.purge_expired
+
+    def spy(**kwargs):
+        batch_sizes.append(kwargs["batch_size"])
+        return purge_expired(**kwargs)
+
+    monkeypatch.setattr(ConfirmationModel, "purge_expired", spy)
+    monkeypatch.setitem(app.config, "CONFIRMATION_PURGE_BATCH_SIZE", 7)
+    runner = app.test_cli_runner()
+
+    assert "0 expired" in runner.invoke(args=["purge-confirmations"]).output
+    runner.invoke(args=["purge-confirmations", "--batch-size", "3"])
+    assert batch_sizes == [7, 3]
@@ -0,0 +1,161 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep
+
+import pytest
+
+from libs import mailgun
+from libs.mailgun import Mailgun, MailGunException
+
+
+class MailgunStub:
+    """
+    A local stand-in for Mailgun's messages endpoint, each request takes the next planned answer, (status, delay)
+    """
+
+    def __init__(self):
+        self.answers = []
+        self.requests = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers["Content-Length"]))
+                stub.requests += 1
+                status, delay = stub.answers.pop(0) if stub.answers else (200, 0)
+                sleep(delay)
+                body = b'{"id": "<stub@mg.test>", "message": "Queued. Thank you."}'
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(body)))
+                    if status == 429:
+                        self.send_header("Retry-After", "1")
+                    self.end_headers()
+                    self.wfile.write(body)
+                except OSError:
+                    pass  # the client timed out and hung up
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/v3"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    # Mailgun is configured through class attributes, they are put back after the test
+    stub = MailgunStub()
+    monkeypatch.setattr(Mailgun, "MAILGUN_API_KEY", "key-stub")
+    monkeypatch.setattr(Mailgun, "MAILGUN_DOMAIN", "mg.test")
+    monkeypatch.setattr(Mailgun, "MAILGUN_API_BASE", stub.url)
+    monkeypatch.setattr(Mailgun, "READ_TIMEOUT", 0.2)
+    monkeypatch.setattr(Mailgun, "MAX_RETRIES", 3)
+    monkeypatch.setattr(Mailgun, "RETRY_BACKOFF", 0.5)
+    monkeypatch.setattr(Mailgun, "_session", None)
+    monkeypatch.setattr(Mailgun, "counters", mailgun.Counters())
+    yield stub
+    stub.server.shutdown()
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """
+    The backoff delays Mailgun asked for, nothing actually sleeps
+    """
+    delays = []
+    monkeypatch.setattr(mailgun, "sleep", delays.append)
+    return delays
+
+
+def send(**kwargs):
+    return Mailgun.send_email(["a@x"], "subject", "text", "html", **kwargs)
+
+
+def test_send(stub, sleeps):
+    for _ in range(3):
+        assert send().status_code == 200
+    assert stub.requests == 3
+    assert sleeps == []
+    assert Mailgun.stats()["calls"] == {"sent": 3}
+
+
+def test_read_timeout_is_not_retried(stub, sleeps):
+    stub.answers = [(200, 1)]
+
+    with pytest.raises(MailGunException) as e:
+        send()
+    assert e.value.status_code is None
+    assert stub.requests == 1  # Mailgun may have accepted the message already
+    assert sleeps == []
+    assert Mailgun.stats()["calls"] == {"failed": 1}
+
+
+def test_server_errors_are_retried_with_jitter(stub, sleeps, monkeypatch):
+    bounds = []
+
+    def uniform(low, high):
+        bounds.append((low, high))
+        return high / 2
+
+    monkeypatch.setattr(mailgun.random, "uniform", uniform)
+    stub.answers = [(500, 0), (503, 0)]
+
+    assert send().status_code == 200
+    assert stub.requests == 3
+    assert bounds == [(0, 0.5), (0, 1.0)]  # full jitter over an exponential backoff
+    assert sleeps == [0.25, 0.5]
+    assert Mailgun.stats()["calls"] == {"retried": 2, "sent": 1}
+
+
+def test_gives_up_after_the_retries(stub, sleeps):
+    stub.answers = [(502, 0)] * 4
+
+    with pytest.raises(MailGunException) as e:
+        send()
+    assert e.value.status_code == 502
+    assert stub.requests == 4
+    assert len(sleeps) == 3
+    assert all(0 <= delay <= 0.5 * 2 ** attempt for attempt, delay in enumerate(sleeps))
+
+
+def test_too_many_requests_waits_for_retry_after(stub, sleeps):
+    stub.answers = [(429, 0)]
+
+    assert send().status_code == 200
+    assert sleeps == [1]
+
+
+def test_client_errors_are_not_retried(stub, sleeps):
+    stub.answers = [(400, 0)]
+
+    with pytest.raises(MailGunException) as e:
+        send()
+    assert e.value.status_code == 400
+    assert stub.requests == 1
+    assert sleeps == []
+    assert Mailgun.stats()["calls"] == {"rejected": 1}
+
+
+def test_single_shot(stub, sleeps):
+    stub.answers = [(500, 0)]
+
+    with pytest.raises(MailGunException):
+        Mailgun.send_batch(["a@x"], "subject", "text", "html", {}, max_retries=0)
+    assert stub.requests == 1
+    assert sleeps == []
+
+
+def test_refused_connections_are_retried(stub, sleeps):
+    stub.server.shutdown()
+    stub.server.server_close()  # nothing listens on the port anymore
+
+    with pytest.raises(MailGunException) as e:
+        send()
+    assert e.value.status_code is None
+    assert len(sleeps) == 3
+    assert Mailgun.stats()["calls"] == {"retried": 3, "failed": 1}
@@ -0,0 +1,59 @@
+import pytest
+
+from models.item import ItemModel
+from models.order import OrderModel, ItemsInOrder, PENDING, COMPLETE, FAILED
+from models.revenue import RevenueByDayModel
+from models.store import StoreModel
+
+
+@pytest.fixture
+def item(app, client):
+    with app.app_context():
+        store = StoreModel(name="store")
+        store.save_to_db()
+        item = ItemModel(name="chair", price=2.5, store_id=store.id)
+        item.save_to_db()
+        return item.id
+
+
+def test_item_ids_may_be_strings(app, client, item):
+    response = client.post("/order", json={"token": "tok_visa", "item_ids": [str(item), item]})
+
+    assert response.status_code == 200, response.json
+    assert "charge_key" not in response.json
+    with app.app_context():
+        (line,) = OrderModel.find_by_id(response.json["id"]).items
+        assert (line.item_id, line.quantity) == (item, 2)
+
+
+def test_missing_item_ids(client, item):
+    response = client.post("/order", json={"token": "tok_visa", "item_ids": [item, "7", "x", 1.5]})
+
+    assert response.status_code == 404
+    assert response.json["missing_item_ids"] == [7, "x", 1.5]
+
+
+@pytest.fixture
+def fake_stripe(monkeypatch):
+    from libs import payments
+
+    fake = payments.FakeStripeClient()
+    monkeypatch.setattr(payments, "payment_client", fake)
+    return fake
+
+
+def test_recovery_sweep_records_the_rollups(app, client, item, fake_stripe):
+    with app.app_context():
+        chair = ItemModel.find_by_id(item)
+        paid, unpaid = (
+            OrderModel(items=[ItemsInOrder(item=chair, quantity=1)], status=PENDING, created_at=1)
+            for _ in range(2)
+        )
+        paid.save_to_db()
+        unpaid.save_to_db()
+        fake_stripe.create_charge(250, "usd", "1x chair", "tok_visa", paid.id, paid.charge_key)
+
+        assert OrderModel.fail_stale_pending() == 2
+        assert (paid.status, unpaid.status) == (COMPLETE, FAILED)
+        rollups = {row.status: row.orders for row in RevenueByDayModel.query}
+        assert rollups == {COMPLETE: 1, FAILED: 1}
@@ -0,0 +1,84 @@
+import pytest
+
+from db import db
+from libs.mail_outbox import MailDispatcher
+from libs.mailgun import Mailgun, MailGunException
+from models.outbox import OutboxEmailModel
+
+
+@pytest.fixture
+def sent(monkeypatch):
+    """
+    Records the Mailgun.send_batch calls instead of sending, append a MailGunException to `sent.errors` to fail the
+    next call
+    """
+
+    class Sent(list):
+        errors = []
+
+    calls = Sent()
+
+    def send_batch(emails, subject, text, html, recipient_variables, max_retries=None):
+        calls.append((emails, recipient_variables, max_retries))
+        if calls.errors:
+            raise calls.errors.pop(0)
+
+    monkeypatch.setattr(Mailgun, "send_batch", send_batch)
+    return calls
+
+
+def test_batch_never_holds_a_recipient_twice(app, client, sent):
+    with app.app_context():
+        OutboxEmailModel.queue("a@x", "s", "%recipient.link%", "h", {"link": "1"})
+        OutboxEmailModel.queue("a@x", "s", "%recipient.link%", "h", {"link": "2"})
+        OutboxEmailModel.queue("b@x", "s", "%recipient.link%", "h", {"link": "3"})
+        dispatcher = MailDispatcher(app, batch_size=10)
+
+        assert dispatcher.dispatch_batch() == 2
+        assert dispatcher.dispatch_batch() == 1
+        assert dispatcher.dispatch_batch() == 0
+
+    assert [call[:2] for call in sent] == [
+        (["a@x", "b@x"], {"a@x": {"link": "1"}, "b@x": {"link": "3"}}),
+        (["a@x"], {"a@x": {"link": "2"}}),
+    ]
+
+
+def test_mailgun_is_called_once_per_attempt(app, client, sent):
+    with app.app_context():
+        OutboxEmailModel.queue("a@x", "s", "t", "h")
+        sent.errors.append(MailGunException("unavailable", 503))
+
+        assert MailDispatcher(app).dispatch_batch() == 1
+        email = OutboxEmailModel.query.one()
+        assert (email.status, email.attempts) == ("queued", 1)
+
+    assert len(sent) == 1
+    assert sent[0][2] == 0  # Mailgun's own retries are off, the outbox backoff retries
+
+
+def test_unexpected_errors_are_retried(app, client, sent):
+    with app.app_context():
+        OutboxEmailModel.queue("a@x", "s", "t", "h")
+        sent.errors.append(ValueError("bad payload"))
+
+        assert MailDispatcher(app).dispatch_batch() == 1
+        email = OutboxEmailModel.query.one()
+        assert (email.status, email.attempts) == ("queued", 1)
+        assert "bad payload" in email.last_error
+
+
+def test_expired_claims_count_as_attempts(app, client, sent):
+    with app.app_context():
+        OutboxEmailModel.queue("a@x", "s", "t", "h")
+        dispatcher = MailDispatcher(app, max_attempts=2)
+        for attempts, status in ((1, "queued"), (2, "failed")):
+            # claimed and then left behind, like by a dispatcher that crashed, not due again yet once requeued
+            OutboxEmailModel.query.update(
+                {"status": "sending", "claimed_at": 0, "next_attempt_at": 2 ** 31 - 1}
+            )
+            db.session.commit()
+            assert dispatcher.dispatch_batch() == 0
+            email = OutboxEmailModel.query.one()
+            assert (email.status, email.attempts) == (status, attempts)
+    assert sent == []
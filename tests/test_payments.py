@@ -0,0 +1,179 @@
+import json
+import threading
+from urllib.parse import parse_qs, urlparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep
+
+import pytest
+import stripe
+
+from libs.circuit_breaker import CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+from libs.payments import StripeClient, PaymentCircuitOpenError
+
+CHARGE = {"id": "ch_stub", "object": "charge", "amount": 500, "paid": True, "status": "succeeded"}
+API_ERROR = {"error": {"type": "api_error", "message": "Stripe is down."}}
+
+
+class StripeStub:
+    """
+    A local stand-in for Stripe's charges endpoint, each request takes the next planned answer, (status, delay).
+    Charge searches find the charges in `found`
+    """
+
+    def __init__(self):
+        self.answers = []
+        self.requests = []
+        self.found = []
+        self.searches = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers["Content-Length"]))
+                stub.requests.append(self.headers.get("Idempotency-Key"))
+                status, delay = stub.answers.pop(0) if stub.answers else (200, 0)
+                sleep(delay)
+                body = json.dumps(CHARGE if status == 200 else API_ERROR).encode()
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except OSError:
+                    pass  # the client timed out and hung up
+
+            def do_GET(self):
+                stub.searches.append(parse_qs(urlparse(self.path).query)["query"][0])
+                body = json.dumps(
+                    {"object": "search_result", "data": stub.found, "has_more": False}
+                ).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    # StripeClient sets these process wide, they are put back after the test
+    monkeypatch.setattr(stripe, "api_base", stripe.api_base)
+    monkeypatch.setattr(stripe, "default_http_client", stripe.default_http_client)
+    monkeypatch.setattr(stripe, "max_network_retries", stripe.max_network_retries)
+    monkeypatch.setattr(stripe.http_client.HTTPClient, "INITIAL_DELAY", 0.01)
+    stub = StripeStub()
+    yield stub
+    stub.server.shutdown()
+
+
+def make_client(stub: StripeStub, **kwargs) -> StripeClient:
+    kwargs.setdefault("breaker", CircuitBreaker(failure_threshold=2, reset_timeout=0.2))
+    return StripeClient(api_key="sk_test_stub", api_base=stub.url, **kwargs)
+
+
+def charge(client: StripeClient, order_key: str = None):
+    return client.create_charge(500, "usd", "1x chair", "tok_visa", order_key=order_key)
+
+
+def test_charge(stub):
+    client = make_client(stub)
+
+    assert charge(client, order_key="key-7")["id"] == "ch_stub"
+    assert stub.requests == ["key-7"]
+    assert client.stats()["calls"] == {"succeeded": 1}
+    assert client.stats()["latency"]["count"] == 1
+
+
+def test_find_charge(stub):
+    client = make_client(stub)
+
+    assert client.find_charge("key-7") is None
+    stub.found = [CHARGE]
+    assert client.find_charge("key-7")["id"] == "ch_stub"
+    assert stub.searches == ["metadata['order_key']:'key-7'"] * 2
+
+
+def test_read_timeout(stub):
+    client = make_client(stub, read_timeout=0.2)
+    stub.answers = [(200, 1)]
+
+    with pytest.raises(stripe.error.APIConnectionError):
+        charge(client)
+    assert client.stats()["calls"] == {"failed": 1}
+    assert client.stats()["circuit_breaker"]["consecutive_failures"] == 1
+
+
+def test_retries_server_errors_and_timeouts_with_the_same_key(stub):
+    client = make_client(stub, read_timeout=0.2, max_network_retries=2)
+    stub.answers = [(500, 0), (200, 1)]  # an error, then a timeout, then the charge
+
+    assert charge(client, order_key="key-3")["id"] == "ch_stub"
+    assert stub.requests == ["key-3"] * 3
+    assert client.breaker.state == CLOSED
+
+
+def test_gives_up_after_the_retries(stub):
+    client = make_client(stub, max_network_retries=1)
+    stub.answers = [(500, 0), (500, 0)]
+
+    with pytest.raises(stripe.error.APIError):
+        charge(client)
+    assert len(stub.requests) == 2
+
+
+def test_breaker_opens_and_recovers(stub):
+    client = make_client(stub)
+    stub.answers = [(500, 0), (500, 0)]
+
+    for _ in range(2):
+        with pytest.raises(stripe.error.APIError):
+            charge(client)
+    assert client.breaker.state == OPEN
+    with pytest.raises(PaymentCircuitOpenError) as e:
+        charge(client)
+    assert e.value.http_status == 503
+    assert len(stub.requests) == 2  # failed fast, Stripe was not called
+
+    sleep(0.25)
+    assert client.breaker.state == HALF_OPEN
+    stub.answers = [(500, 0)]
+    with pytest.raises(stripe.error.APIError):
+        charge(client)  # the trial call fails, open again
+    assert client.breaker.state == OPEN
+
+    sleep(0.25)
+    assert charge(client)["id"] == "ch_stub"  # the trial call succeeds
+    assert client.breaker.state == CLOSED
+    assert client.stats()["calls"] == {"failed": 3, "rejected": 1, "succeeded": 1}
+
+
+def test_unexpected_error_in_trial_call_does_not_wedge_the_breaker(stub, monkeypatch):
+    client = make_client(stub)
+    stub.answers = [(500, 0), (500, 0)]
+    for _ in range(2):
+        with pytest.raises(stripe.error.APIError):
+            charge(client)
+    sleep(0.25)
+
+    def broken(**kwargs):
+        raise ValueError("not a Stripe error")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(stripe.Charge, "create", broken)
+        with pytest.raises(ValueError):
+            charge(client)
+    assert client.breaker.state == OPEN  # counted as a failure
+
+    sleep(0.25)
+    assert charge(client)["id"] == "ch_stub"  # and the next trial call is let through
+    assert client.breaker.state == CLOSED
@@ -0,0 +1,40 @@
+def _create_stores(app, stores: int, items_per_store: int) -> None:
+    from db import db
+    from models.item import ItemModel
+    from models.store import StoreModel
+
+    with app.app_context():
+        for number in range(stores):
+            store = StoreModel(name=f"store {number}")
+            db.session.add(store)
+            db.session.flush()
+            for item in range(items_per_store):
+                db.session.add(
+                    ItemModel(name=f"item {number}-{item}", price=item + 0.5, store_id=store.id)
+                )
+        db.session.commit()
+
+
+def test_store_list_query_count(app, client, query_counter):
+    # the stores and then the items of all of them, however many stores there are
+    _create_stores(app, stores=5, items_per_store=4)
+    query_counter.count = 0
+
+    response = client.get("/stores")
+
+    assert response.status_code == 200
+    stores = response.json["stores"]
+    assert [len(store["items"]) for store in stores] == [4] * 5
+    assert stores[2]["items"][0]["name"] == "item 2-0"
+    assert query_counter.count == 2
+
+
+def test_store_page_query_count(app, client, query_counter):
+    _create_stores(app, stores=5, items_per_store=3)
+    query_counter.count = 0
+
+    response = client.get("/stores?limit=2")
+
+    assert response.status_code == 200
+    assert [store["name"] for store in response.json["stores"]] == ["store 0", "store 1"]
+    assert query_counter.count == 2
@@ -0,0 +1,73 @@
+from datetime import timedelta
+from time import sleep
+
+import pytest
+from flask_jwt_extended import create_access_token, view_decorators
+
+from blacklist import BLACKLIST
+from libs.token_cache import token_cache
+
+
+@pytest.fixture
+def cache(app, client, monkeypatch):
+    monkeypatch.setattr(BLACKLIST, "sync_interval", 0)
+    monkeypatch.setattr(token_cache, "max_size", 1024)
+    monkeypatch.setattr(token_cache, "hits", 0)
+    monkeypatch.setattr(token_cache, "misses", 0)
+    token_cache.clear()
+    yield token_cache
+    token_cache.clear()
+
+
+def auth(token: str):
+    return {"Authorization": f"Bearer {token}"}
+
+
+def access_token(app, **kwargs) -> str:
+    with app.app_context():
+        return create_access_token(identity=1, **kwargs)
+
+
+def test_view_decorators_use_the_cache(cache):
+    assert view_decorators.decode_token == cache.decode_token
+    assert view_decorators.get_unverified_jwt_headers == cache.get_unverified_jwt_headers
+
+
+def test_repeat_tokens_are_not_verified_again(app, client, cache):
+    token = access_token(app)
+
+    for _ in range(3):
+        assert client.get("/image/missing.png", headers=auth(token)).status_code == 404
+    assert (cache.misses, cache.hits) == (1, 2)
+    assert cache.get_unverified_jwt_headers(token) == {"typ": "JWT", "alg": "HS256"}
+
+
+def test_revoked_token_is_rejected_on_a_cache_hit(app, client, cache):
+    token = access_token(app)
+    assert client.get("/image/missing.png", headers=auth(token)).status_code == 404
+    assert client.post("/logout", headers=auth(token)).status_code == 200
+    hits = cache.hits
+
+    response = client.get("/image/missing.png", headers=auth(token))
+    assert response.status_code == 401
+    assert cache.hits == hits + 1  # the claims came from the cache, the revocation check still ran
+
+
+def test_expired_entry_is_verified_again(app, client, cache):
+    token = access_token(app, expires_delta=timedelta(seconds=1))
+    assert client.get("/image/missing.png", headers=auth(token)).status_code == 404
+    sleep(2.1)  # PyJWT compares exp to whole seconds
+
+    response = client.get("/image/missing.png", headers=auth(token))
+    assert response.status_code == 401
+    assert response.json["error"] == "token_expired"
+    assert cache.misses == 2 and cache.stats()["size"] == 0
+
+
+def test_tampered_token_is_a_miss(app, client, cache):
+    token = access_token(app)
+    assert client.get("/image/missing.png", headers=auth(token)).status_code == 404
+    tampered = token[:-2] + ("AA" if token[-2:] != "AA" else "BB")
+
+    assert client.get("/image/missing.png", headers=auth(tampered)).status_code == 401
+    assert cache.hits == 0